@@ -0,0 +1,34 @@
+#Images are decoded and scaled to the window once and kept in memory, sounds are only opened when first played
+#drawImage with a file path decodes and rescales the file on every redraw, a cached CMUImage does not
+
+from cmu_graphics import CMUImage, Sound
+from PIL import Image
+
+class Assets:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.pictures = {} #(path, size) -> decoded PIL image
+        self.images = {} #Path -> CMUImage at window size
+        self.sounds = {} #Path -> Sound
+
+    def picture(self, path, size):
+        #Decoded PIL image, for code that paints on top of it like the static layer
+        key = (path, size)
+        if key not in self.pictures:
+            self.pictures[key] = Image.open(path).convert('RGB').resize(size)
+        return self.pictures[key]
+
+    def image(self, path):
+        if path not in self.images:
+            self.images[path] = CMUImage(self.picture(path, (self.width, self.height)))
+        return self.images[path]
+
+    def sound(self, path):
+        if path not in self.sounds:
+            self.sounds[path] = Sound(path)
+        return self.sounds[path]
+
+    def preload(self, paths):
+        for path in paths:
+            self.image(path)
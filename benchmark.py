@@ -0,0 +1,262 @@
+#Times the hot paths of the simulation on synthetic networks of growing size, plus whole seeded games
+#Results go to JSON, and a run can be compared against an earlier one to flag regressions
+#Usage: python benchmark.py [--json results.json] [--compare baseline.json] [--threshold 0.25] [--quick] [--stress [--stations 1000]]
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from montecarlo import playGame, decisionTarget, SWEEP_DIFFICULTIES
+from planner import GreedyPlanner, POLICIES
+from simulation import (Simulation, Station, Passenger, Line, findPathBFS, findTransfer, findExtendableLine,
+                        shapeCode, PROCEDURAL_MAP, SITE_SPACING)
+try:
+    from render import StaticLayer
+except ImportError: #Needs cmu_graphics, the stress run skips painting without it
+    StaticLayer = None
+
+#(stations, lines) of the synthetic networks
+SIZES = [(10, 1), (50, 3), (100, 5), (250, 10), (500, 20)]
+QUICK_SIZES = [(10, 1), (100, 5)]
+SHAPES = ['circle', 'square', 'triangle', 'diamond', 'pentagon']
+GAME_STEPS = 36000 #10 minutes of game time
+GAME_POLICY = 'greedy' #Lasts the full 10 minutes on Easy, harder games end early and report the steps they ran
+STRESS_MILESTONES = [50, 100, 250, 500, 1000, 2000, 5000] #Station counts the stress run stops at
+
+def makeNetwork(stationCount, lineCount, seed=0):
+    #Stations on a jittered grid, each line a walk through nearby stations, so lines cross and share stations
+    rng = random.Random(seed)
+    columns = max(1, int(stationCount ** 0.5))
+    sim = Simulation('New York', 'Medium', seed, width=columns * 120 + 200, height=columns * 120 + 300, startStations=False)
+    for i in range(stationCount):
+        x = 100 + (i % columns) * 120 + rng.randint(-30, 30)
+        y = 100 + (i // columns) * 120 + rng.randint(-30, 30)
+        sim.addStation(Station(x, y, SHAPES[i % len(SHAPES)]))
+    length = max(2, min(stationCount, 2 * stationCount // lineCount))
+    for i in range(lineCount):
+        line = Line(f'line{i}', sim)
+        sim.lines.append(line)
+        station = rng.choice(sim.stations)
+        line.linkStation(station)
+        while len(line.stations) < length:
+            candidates = [s for s in sim.grid.near(station.x, station.y, 250) if not line.hasStation(s)]
+            if not candidates:
+                break
+            station = rng.choice(candidates)
+            line.linkStation(station)
+    return sim
+
+def measure(fn, setup=None, minTime=0.05, repeats=5):
+    #Best of repeats of the mean time per call in microseconds, setup runs untimed before every call
+    calls = 1
+    while True: #Grow the batch until one batch takes minTime
+        elapsed = timeBatch(fn, setup, calls)
+        if elapsed >= minTime or calls >= 1 << 20:
+            break
+        calls *= 2
+    best = elapsed / calls
+    for _ in range(repeats - 1):
+        best = min(best, timeBatch(fn, setup, calls) / calls)
+    return best * 1e6
+
+def timeBatch(fn, setup, calls):
+    if setup is None:
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        return time.perf_counter() - start
+    elapsed = 0.0
+    for _ in range(calls):
+        setup()
+        start = time.perf_counter()
+        fn()
+        elapsed += time.perf_counter() - start
+    return elapsed
+
+def networkBenchmarks(stationCount, lineCount):
+    sim = makeNetwork(stationCount, lineCount)
+    rng = random.Random(1)
+    starts = [rng.choice(sim.stations) for _ in range(64)]
+    shapes = [rng.choice(SHAPES) for _ in range(64)]
+    pick = iter(range(1 << 30))
+    def nextQuery():
+        i = next(pick) % 64
+        return starts[i], shapes[i]
+
+    def routingTable():
+        sim.routes.invalidate()
+        for shape in SHAPES:
+            sim.routes.nextTransfer(sim.stations[0], shapeCode(shape))
+
+    train = sim.lines[0].trains[0]
+    def refill():
+        #Full station queue and an empty train standing at its current station
+        station = train.line.stations[train.currentIndex]
+        station.passengers = type(station.passengers)()
+        for i in range(sim.stationCapacity):
+            station.passengers.append(Passenger((i + 1) % len(SHAPES)))
+        train.passengers = []
+
+    trains = [t for line in sim.lines for t in line.trains]
+    def positions():
+        for t in trains:
+            t.positionAt(sim.motionTimer)
+
+    selected = sim.stations[0]
+    def extendable():
+        for station in sim.stations:
+            if station is not selected:
+                findExtendableLine(selected, station)
+
+    def networkChanged():
+        sim.topologyChanged() #Published like a real change, so every subscriber runs before the rebuild
+
+    def segmentMap():
+        sim.segment_map.clear()
+        sim.trackOffsets.clear()
+        for line in sim.lines:
+            for i in range(len(line.stations) - 1):
+                sim.updateSegmentMap(line, line.stations[i], line.stations[i+1])
+
+    return {
+        'findPathBFS': measure(lambda: findPathBFS(*nextQuery())),
+        'findTransfer': measure(lambda: findTransfer(*nextQuery())),
+        'routingTable': measure(routingTable),
+        'handlePassengers': measure(train.handlePassengers, refill),
+        'trainPositions': measure(positions),
+        'findExtendableLine': measure(extendable),
+        'candidatesHit': measure(lambda: sim.connectionCandidates(selected)),
+        'candidatesRebuild': measure(lambda: sim.connectionCandidates(selected), networkChanged),
+        'segmentMap': measure(segmentMap),
+    }
+
+def steppedGame(mapName, difficulty, seed):
+    #Step by step like the window does, with the same player as the event-driven game
+    sim = Simulation(mapName, difficulty, seed)
+    policy = POLICIES[GAME_POLICY]()
+    policy.act(sim)
+    while not sim.gameOver and sim.timer < GAME_STEPS:
+        sim.step()
+        if policy.needsAction(sim):
+            policy.act(sim)
+    return sim.timer
+
+def gameBenchmarks():
+    #Whole seeded games up to 10 minutes, jumping between events as montecarlo.py does and step by step
+    results = {}
+    for difficulty in SWEEP_DIFFICULTIES:
+        start = time.perf_counter()
+        game = playGame(('Tokyo', difficulty, 0, GAME_STEPS, 'uniform', 'time', GAME_POLICY))
+        results[f'game/{difficulty}'] = {'ms': (time.perf_counter() - start) * 1000, 'steps': int(game['survivalSeconds'] * 60)}
+        start = time.perf_counter()
+        steps = steppedGame('Tokyo', difficulty, 0)
+        results[f'steppedGame/{difficulty}'] = {'ms': (time.perf_counter() - start) * 1000, 'steps': steps}
+    return results
+
+def stressBenchmarks(maxStations):
+    #One procedural Stress game grown by the greedy planner, at every milestone the costs that grow with the network
+    #are timed, so anything superlinear shows up as the numbers climb faster than the station count
+    #Map big enough for maxStations sites at 16:9, a site takes about 1.6 spacings squared
+    height = int((maxStations * 1.6 * SITE_SPACING**2 * 9 / 16) ** 0.5) + 300
+    width = height * 16 // 9 + 200
+    sim = Simulation(PROCEDURAL_MAP, 'Stress', 0, width, height)
+    planner = GreedyPlanner()
+    planner.act(sim)
+    rng = random.Random(1)
+    results = {}
+    stepTime, stepFrom = 0.0, sim.timer
+    for milestone in (m for m in STRESS_MILESTONES if m <= min(maxStations, sim.stationLimit)):
+        while len(sim.stations) < milestone and not sim.gameOver:
+            start = time.perf_counter()
+            sim.advance(decisionTarget(planner, sim, sim.timer + 100000), lambda: planner.needsAction(sim))
+            stepTime += time.perf_counter() - start
+            if planner.needsAction(sim):
+                planner.act(sim)
+        if sim.gameOver:
+            print(f'Stress game over at {len(sim.stations)} stations', file=sys.stderr)
+            break
+        results[f'stress/stepUs/{milestone}'] = {'us': stepTime / (sim.timer - stepFrom) * 1e6}
+        stepTime, stepFrom = 0.0, sim.timer
+
+        def routingTable():
+            sim.routes.invalidate()
+            for shape in sim.shapes:
+                sim.routes.nextTransfer(sim.stations[0], shapeCode(shape))
+        clicks = [(rng.randint(0, width), rng.randint(0, height)) for _ in range(64)]
+        pick = iter(range(1 << 30))
+        selected = sim.stations[0]
+        def networkChanged():
+            sim.topologyChanged()
+        results[f'stress/routingTable/{milestone}'] = {'us': measure(routingTable, repeats=3)}
+        results[f'stress/stationAt/{milestone}'] = {'us': measure(lambda: sim.stationAt(*clicks[next(pick) % 64]))}
+        results[f'stress/highlightsHit/{milestone}'] = {'us': measure(lambda: sim.connectionCandidates(selected))}
+        results[f'stress/highlightsRebuild/{milestone}'] = {'us': measure(lambda: sim.connectionCandidates(selected), networkChanged, repeats=3)}
+        if StaticLayer is not None:
+            layer = StaticLayer(None, None, width, height)
+            results[f'stress/staticPaint/{milestone}'] = {'us': measure(lambda: layer.paint(sim), minTime=0, repeats=1)}
+        print(f'{milestone} stations, {len(sim.lines)} lines done', file=sys.stderr)
+    return results
+
+def runBenchmarks(sizes):
+    results = {}
+    for stationCount, lineCount in sizes:
+        for name, us in networkBenchmarks(stationCount, lineCount).items():
+            results[f'{name}/{stationCount}x{lineCount}'] = {'us': us}
+        print(f'{stationCount} stations, {lineCount} lines done', file=sys.stderr)
+    results.update(gameBenchmarks())
+    return results
+
+def value(result):
+    return result['us'] if 'us' in result else result['ms']
+
+def compare(baseline, current, threshold):
+    #Names of benchmarks slower than baseline by more than threshold (0.25 = 25%)
+    regressions = []
+    for name, result in current.items():
+        if name not in baseline:
+            continue
+        old, new = value(baseline[name]), value(result)
+        change = (new - old) / old if old else 0
+        flag = 'REGRESSION' if change > threshold else ''
+        print(f'{name:<32} {old:>12.2f} {new:>12.2f} {change:>+8.1%} {flag}')
+        if flag:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the simulation hot paths')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='earlier results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='slowdown counted as a regression, 0.25 = 25%%')
+    parser.add_argument('--quick', action='store_true', help='only the small networks')
+    parser.add_argument('--stress', action='store_true', help='grow one procedural game instead, see stressBenchmarks')
+    parser.add_argument('--stations', type=int, default=1000, help='stations the stress game grows to')
+    args = parser.parse_args()
+
+    if args.stress:
+        results = stressBenchmarks(args.stations)
+    else:
+        results = runBenchmarks(QUICK_SIZES if args.quick else SIZES)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        print(f"{'Benchmark':<32} {'before':>12} {'after':>12} {'change':>8}")
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regression(s) over {args.threshold:.0%}')
+            sys.exit(1)
+    else:
+        for name, result in results.items():
+            unit = 'us' if 'us' in result else 'ms'
+            steps = f"  {result['steps']} steps" if 'steps' in result else ''
+            print(f'{name:<32} {value(result):>12.2f} {unit}{steps}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#Struct-of-arrays train positions for drawing: departure point, per-step movement and timing of every train live in NumPy arrays
+#One vectorized call places all trains for a frame, instead of one Train.positionAt call per train per read
+#Arrivals stay events of the simulation, they rarely fall on the same step, so batching them here would cost more than
+#it saves, and headless games never ask where a train is
+#Needs numpy, attach with TrainArrays(sim), the simulation hands it every schedule a train departs on
+
+import numpy as np
+
+class TrainArrays:
+    def __init__(self, sim, capacity=16):
+        self.slots = {} #Train -> row
+        self.fromX = np.zeros(capacity)
+        self.fromY = np.zeros(capacity)
+        self.stepX = np.zeros(capacity)
+        self.stepY = np.zeros(capacity)
+        self.targetX = np.zeros(capacity)
+        self.targetY = np.zeros(capacity)
+        self.departStep = np.zeros(capacity, dtype=np.int64)
+        self.arriveStep = np.zeros(capacity, dtype=np.int64)
+        self.step = None #Step the cached positions are for, None after any schedule changes
+        self.x = self.y = None
+        sim.kinematics = self
+        for line in sim.lines: #Trains of a loaded snapshot are already on their way
+            for train in line.trains:
+                self.update(train)
+
+    def add(self, train):
+        slot = len(self.slots)
+        if slot == len(self.fromX): #Full, double every array
+            for name in ('fromX', 'fromY', 'stepX', 'stepY', 'targetX', 'targetY', 'departStep', 'arriveStep'):
+                old = getattr(self, name)
+                grown = np.zeros(len(old) * 2, dtype=old.dtype)
+                grown[:slot] = old
+                setattr(self, name, grown)
+        self.slots[train] = slot
+        return slot
+
+    def update(self, train):
+        #Called by the simulation whenever the train departs on a new schedule
+        slot = self.slots.get(train)
+        if slot is None:
+            slot = self.add(train)
+        self.fromX[slot], self.fromY[slot] = train.fromX, train.fromY
+        self.stepX[slot], self.stepY[slot] = train.stepX, train.stepY
+        target = train.line.stations[train.targetIndex]
+        self.targetX[slot], self.targetY[slot] = target.x, target.y
+        self.departStep[slot], self.arriveStep[slot] = train.departStep, train.arriveStep
+        self.step = None
+
+    def positions(self, step):
+        #Same rule as Train.positionAt, for every train at once, cached until the step or a schedule changes
+        if self.step != step:
+            n = len(self.slots)
+            depart = self.departStep[:n]
+            lastMove = self.arriveStep[:n] - depart
+            moves = np.clip(step - depart + 1, 0, lastMove)
+            x = self.fromX[:n] + self.stepX[:n] * moves
+            y = self.fromY[:n] + self.stepY[:n] * moves
+            #Between the last full move and snapping onto the target
+            t = np.clip(step - depart + 1 - lastMove, 0, 1)
+            self.x = x + (self.targetX[:n] - x) * t
+            self.y = y + (self.targetY[:n] - y) * t
+            self.step = step
+        return self.x, self.y
+
+    def positionAt(self, train, step):
+        x, y = self.positions(step)
+        slot = self.slots[train]
+        return float(x[slot]), float(y[slot])
@@ -0,0 +1,53 @@
+#Procedural maps: station sites spread with Poisson-disk sampling (Bridson's algorithm)
+#Sites are at least spacing apart but otherwise random, and come out in the order the sampling grew them,
+#outwards from the centre, so a map built from them grows like a city
+
+import math
+from collections import deque
+
+def poissonDisk(rng, bounds, spacing, limit=None, attempts=30):
+    #Points inside bounds (left, top, right, bottom) no closer than spacing to each other, at most limit of them
+    left, top, right, bottom = bounds
+    cellSize = spacing / math.sqrt(2) #At most one point per cell
+    columns = int((right - left) // cellSize) + 1
+    rows = int((bottom - top) // cellSize) + 1
+    grid = [None] * (columns * rows) #Cell -> index of the point in it
+    points = []
+    active = deque() #Points that may still have room around them
+
+    def cellOf(x, y):
+        return int((x - left) // cellSize), int((y - top) // cellSize)
+
+    def fits(x, y):
+        if not (left <= x <= right and top <= y <= bottom):
+            return False
+        column, row = cellOf(x, y)
+        for c in range(max(0, column - 2), min(columns, column + 3)):
+            for r in range(max(0, row - 2), min(rows, row + 3)):
+                index = grid[r * columns + c]
+                if index is not None:
+                    px, py = points[index]
+                    if (px - x)**2 + (py - y)**2 < spacing**2:
+                        return False
+        return True
+
+    def add(x, y):
+        column, row = cellOf(x, y)
+        grid[row * columns + column] = len(points)
+        active.append(len(points))
+        points.append((x, y))
+
+    add((left + right) / 2, (top + bottom) / 2)
+    while active and (limit is None or len(points) < limit):
+        #Oldest active point first, so the sampling grows outwards in rings
+        x, y = points[active[0]]
+        for _ in range(attempts):
+            angle = rng.uniform(0, 2 * math.pi)
+            distance = rng.uniform(spacing, 2 * spacing)
+            nx, ny = x + distance * math.cos(angle), y + distance * math.sin(angle)
+            if fits(nx, ny):
+                add(nx, ny)
+                break
+        else: #No room left around this point
+            active.popleft()
+    return [(round(x), round(y)) for x, y in points]
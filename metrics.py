@@ -0,0 +1,88 @@
+#Passenger flow while a game runs: station queues, segment loads, train occupancy and trip times
+#Everything sits in fixed-size ring buffers sampled once per interval, so the cost stays flat however long the game runs
+#Attach with sim.metrics = FlowMetrics(stream='metrics/run.jsonl') to also write every sample as one JSON line
+
+import json
+import os
+from collections import deque
+from simulation import STEPS_PER_SECOND, segmentKey
+
+class FlowMetrics:
+    def __init__(self, window=60, interval=STEPS_PER_SECOND, trips=1000, stream=None):
+        self.window = window #Samples kept per station, segment and train
+        self.interval = interval #Steps between samples
+        self.queues = {} #Station -> deque of queue lengths
+        self.loads = {} #Segment -> deque of passengers carried over it per interval
+        self.occupancy = {} #Train -> deque of passengers / capacity when leaving a station
+        self.latencies = deque(maxlen=trips) #Steps from spawn to delivery of the latest trips
+        self.carried = {} #Segment -> passengers carried over it since the last sample
+        self.delivered = [] #Trip steps since the last sample, for the stream
+        self.sampleStep = None #Interval of the last sample
+        self.stream = None
+        if stream:
+            folder = os.path.dirname(stream)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self.stream = open(stream, 'w')
+
+    def departed(self, train, s1, s2):
+        #Train leaves s1 for s2 with its current passengers
+        segment = segmentKey(s1, s2)
+        self.carried[segment] = self.carried.get(segment, 0) + len(train.passengers)
+        self.occupancy.setdefault(train, deque(maxlen=self.window)).append(len(train.passengers) / train.capacity)
+
+    def tripEnded(self, passenger, step):
+        if passenger.spawnStep is not None: #Passengers made outside a running game don't know when they spawned
+            self.latencies.append(step - passenger.spawnStep)
+            self.delivered.append(step - passenger.spawnStep)
+
+    def stepped(self, sim):
+        #Called after every simulation step that ran, samples when a new interval has started
+        interval = sim.timer // self.interval
+        if interval != self.sampleStep:
+            self.sampleStep = interval
+            self.sample(sim)
+
+    def sample(self, sim):
+        for station in sim.stations:
+            self.queues.setdefault(station, deque(maxlen=self.window)).append(len(station.passengers))
+        for segment in sim.segment_map:
+            self.loads.setdefault(segment, deque(maxlen=self.window)).append(self.carried.get(segment, 0))
+        if self.stream is not None:
+            stationIndex = {station: i for i, station in enumerate(sim.stations)}
+            row = {
+                'step': sim.timer,
+                'stationCapacity': sim.stationCapacity,
+                'queues': [len(station.passengers) for station in sim.stations],
+                'segments': [[stationIndex[s1], stationIndex[s2], self.carried.get((s1, s2), 0)] for s1, s2 in sim.segment_map],
+                'trains': [[line.number, i, round(len(train.passengers) / train.capacity, 3)]
+                           for line in sim.lines for i, train in enumerate(line.trains)],
+                'trips': self.delivered,
+            }
+            self.stream.write(json.dumps(row, separators=(',', ':')) + '\n')
+        self.carried = {}
+        self.delivered = []
+
+    def pressure(self, station, capacity, recent=5):
+        #Average queue over the last few samples as a share of capacity, 1 means about to overflow
+        samples = self.queues.get(station)
+        if not samples:
+            return 0.0
+        recent = min(recent, len(samples))
+        return sum(samples[-i] for i in range(1, recent + 1)) / recent / capacity
+
+    def segmentLoads(self):
+        #Segment -> average passengers carried per interval over the window
+        return {segment: sum(samples) / len(samples) for segment, samples in self.loads.items() if samples}
+
+    def tripPercentiles(self):
+        #(p50, p90) trip time in steps over the latest trips, None before the first one
+        if not self.latencies:
+            return None
+        values = sorted(self.latencies)
+        return values[len(values) // 2], values[min(len(values) - 1, int(len(values) * 0.9))]
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
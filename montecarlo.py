@@ -0,0 +1,115 @@
+#Runs many seeded headless games over a process pool, one worker per core
+#Every map and difficulty preset is played by the same policy, the scripted line builder unless --policy picks a planner
+#Usage: python montecarlo.py [--games 100] [--minutes 10] [--workers N] [--demand rushHour] [--routing hops] [--policy greedy] [--maps Procedural] [--difficulties Stress] [--json results.json]
+
+import argparse
+import json
+import os
+import statistics
+import time
+from multiprocessing import Pool
+from planner import POLICIES
+from simulation import Simulation, DIFFICULTIES, DEMANDS, ROUTINGS, MAPS, PROCEDURAL_MAP
+
+#Swept unless --difficulties says otherwise, Stress is for scaling runs
+SWEEP_DIFFICULTIES = ['Easy', 'Medium', 'Hard']
+
+def decisionTarget(policy, sim, maxSteps):
+    #Timer to advance to at most, the policy's next timed decision if that comes first
+    decision = policy.nextDecisionStep(sim)
+    return maxSteps if decision is None else min(maxSteps, decision)
+
+def playGame(task):
+    mapName, difficulty, seed, maxSteps, demand, routing, policyName = task
+    sim = Simulation(mapName, difficulty, seed, demand=DEMANDS[demand], routing=routing)
+    policy = POLICIES[policyName]()
+    policy.act(sim)
+    while not sim.gameOver and sim.timer < maxSteps:
+        #Only act when the policy wants to, the simulation jumps straight there
+        sim.advance(decisionTarget(policy, sim, maxSteps), lambda: policy.needsAction(sim))
+        if policy.needsAction(sim):
+            policy.act(sim)
+    minutes = sim.timer / 3600
+    return {
+        'map': mapName,
+        'difficulty': difficulty,
+        'seed': seed,
+        'survivalSeconds': sim.timer / 60,
+        'gameOver': sim.gameOver,
+        'trips': sim.passengersTrips,
+        'tripsPerMinute': sim.passengersTrips / minutes if minutes else 0,
+    }
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+def summarize(values):
+    return {
+        'mean': statistics.fmean(values),
+        'p10': percentile(values, 10),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+    }
+
+def aggregate(results):
+    groups = {}
+    for result in results:
+        groups.setdefault((result['map'], result['difficulty']), []).append(result)
+    summary = []
+    for (mapName, difficulty), games in sorted(groups.items()):
+        summary.append({
+            'map': mapName,
+            'difficulty': difficulty,
+            'games': len(games),
+            'survived': sum(not game['gameOver'] for game in games),
+            'survivalSeconds': summarize([game['survivalSeconds'] for game in games]),
+            'tripsPerMinute': summarize([game['tripsPerMinute'] for game in games]),
+        })
+    return summary
+
+def runSweep(games, maxSteps, workers=None, firstSeed=0, demand='uniform', routing='time', policy='scripted',
+             maps=tuple(MAPS), difficulties=tuple(SWEEP_DIFFICULTIES)):
+    tasks = [(mapName, difficulty, firstSeed + i, maxSteps, demand, routing, policy)
+             for mapName in maps for difficulty in difficulties for i in range(games)]
+    workers = workers or os.cpu_count()
+    #Big chunks keep the workers busy instead of waiting on the queue
+    chunksize = max(1, len(tasks) // (workers * 4))
+    with Pool(workers) as pool:
+        return list(pool.imap_unordered(playGame, tasks, chunksize=chunksize))
+
+def main():
+    parser = argparse.ArgumentParser(description='Monte Carlo difficulty sweep over every map and difficulty')
+    parser.add_argument('--games', type=int, default=100, help='games per map and difficulty')
+    parser.add_argument('--minutes', type=float, default=10, help='game time cap per game')
+    parser.add_argument('--workers', type=int, default=None, help='processes, defaults to one per core')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first game, the rest count up')
+    parser.add_argument('--demand', choices=list(DEMANDS), default='uniform', help='spawn weighting preset')
+    parser.add_argument('--routing', choices=list(ROUTINGS), default='time', help='fastest routes or fewest stops')
+    parser.add_argument('--policy', choices=list(POLICIES), default='scripted', help='who builds the lines')
+    parser.add_argument('--maps', nargs='+', choices=list(MAPS) + [PROCEDURAL_MAP], default=list(MAPS), help='maps to play')
+    parser.add_argument('--difficulties', nargs='+', choices=list(DIFFICULTIES), default=SWEEP_DIFFICULTIES, help='difficulties to play')
+    parser.add_argument('--json', help='write per-game results and the summary to this file')
+    args = parser.parse_args()
+
+    startTime = time.perf_counter()
+    results = runSweep(args.games, int(args.minutes * 3600), args.workers, args.seed, args.demand, args.routing, args.policy,
+                       args.maps, args.difficulties)
+    elapsed = time.perf_counter() - startTime
+    summary = aggregate(results)
+
+    print(f"{'Map':<10} {'Difficulty':<10} {'Games':>5} {'Survived':>8} "
+          f"{'Survival s p10/p50/p90':>24} {'Trips/min mean/p50':>20}")
+    for row in summary:
+        survival, trips = row['survivalSeconds'], row['tripsPerMinute']
+        print(f"{row['map']:<10} {row['difficulty']:<10} {row['games']:>5} {row['survived']:>8} "
+              f"{survival['p10']:>8.0f}/{survival['p50']:>6.0f}/{survival['p90']:>6.0f} "
+              f"{trips['mean']:>12.2f}/{trips['p50']:>6.2f}")
+    print(f'{len(results)} games in {elapsed:.1f}s')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'summary': summary, 'games': results}, f, indent=1)
+
+if __name__ == '__main__':
+    main()
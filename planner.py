@@ -0,0 +1,145 @@
+#Players for headless games: a policy looks at the simulation and issues the same actions a player's clicks would
+#act(sim) runs at the start and whenever needsAction(sim) turns true, everything goes through sim.connect/addTrain/addCarriage
+#so the rules of findExtendableLine apply and the actions end up in replays
+#Headless loops advance to nextDecisionStep(sim) at most, so decisions due on a set step are taken on that step
+#whether the simulation jumps between events or steps one at a time
+
+import time
+from simulation import findExtendableLine
+
+def distance2(s1, s2):
+    return (s1.x - s2.x)**2 + (s1.y - s2.y)**2
+
+class Policy:
+    def __init__(self):
+        self.handled = 0 #Stations looked at so far
+
+    def needsAction(self, sim):
+        return len(sim.stations) != self.handled
+
+    def nextDecisionStep(self, sim):
+        #Timer of the next decision no simulation event triggers, None if there is none
+        return None
+
+    def act(self, sim):
+        self.handled = len(sim.stations)
+
+class ScriptedPolicy(Policy):
+    #Chain the starting stations, then hook every new station onto its nearest line end
+    def act(self, sim):
+        if self.handled == 0:
+            for i in range(len(sim.stations) - 1):
+                sim.connect(sim.stations[i], sim.stations[i+1])
+            self.handled = len(sim.stations)
+        for station in sim.stations[self.handled:]:
+            endpoints = [s for line in sim.lines for s in line.getEndpoints()]
+            target = min((s for s in endpoints or sim.stations if s is not station), key=lambda s: distance2(s, station))
+            sim.connect(target, station)
+        self.handled = len(sim.stations)
+
+class GreedyPlanner(Policy):
+    #Links every unconnected station by the cheapest move: extend a line from one of its ends, or open a new line
+    #Extensions that give a line a shape it does not reach yet count as shorter, that saves passengers a transfer
+    #Every decision has a budget of candidate moves, when it runs out the best move found so far is taken
+    #Counted in moves rather than seconds so a seeded game decides the same on any machine and under any load
+    #Spare trains and carriages go to the line of the most crowded station once it is half full
+    def __init__(self, budget=100, newLineCost=1.5, shapeBonus=0.7, checkEvery=300):
+        super().__init__()
+        self.budget = budget #Candidate moves per decision, two per line end and two new lines fit 40 colors
+        self.newLineCost = newLineCost #A new line costs this many times its length, colors are scarce
+        self.shapeBonus = shapeBonus #Extensions to a new shape cost this many times their length
+        self.checkEvery = checkEvery #Steps between looks at the station queues
+        self.nextCheck = 0
+        self.decisions = 0
+        self.overBudget = 0 #Decisions cut short by the budget
+        self.slowest = 0.0 #Seconds of the slowest decision
+
+    def needsAction(self, sim):
+        return len(sim.stations) != self.handled or sim.timer >= self.nextCheck
+
+    def nextDecisionStep(self, sim):
+        return self.nextCheck
+
+    def act(self, sim):
+        if len(sim.stations) != self.handled:
+            for station in sim.stations:
+                if not station.lines:
+                    self.decide(sim, station)
+            self.handled = len(sim.stations)
+        if sim.timer >= self.nextCheck:
+            self.nextCheck = sim.timer + self.checkEvery
+            self.addRollingStock(sim)
+
+    def decide(self, sim, station):
+        start = time.perf_counter()
+        best = None #(cost, station1, station2, forceNewLine)
+        for evaluated, (cost, s1, s2, forceNewLine) in enumerate(self.candidates(sim, station), 1):
+            if best is None or cost < best[0]:
+                best = (cost, s1, s2, forceNewLine)
+            if evaluated >= self.budget:
+                self.overBudget += 1
+                break
+        if best is not None:
+            sim.connect(best[1], best[2], best[3])
+        elapsed = time.perf_counter() - start
+        self.decisions += 1
+        self.slowest = max(self.slowest, elapsed)
+
+    def candidates(self, sim, station):
+        #(cost, station1, station2, forceNewLine) of every move that links station, checked like a click would be
+        for line in sim.lines:
+            for end in line.getEndpoints():
+                extendableLine, endpoint, _ = findExtendableLine(end, station)
+                if extendableLine is line and endpoint is end:
+                    cost = distance2(end, station)**0.5
+                    if not line.reaches(station.shapeCode):
+                        cost *= self.shapeBonus
+                    yield cost, end, station, False
+        if len(sim.lines) < len(sim.colors):
+            for other in self.newLinePartners(sim, station):
+                yield distance2(other, station)**0.5 * self.newLineCost, station, other, True
+
+    def newLinePartners(self, sim, station):
+        #Stations a new line from station could start at: the nearest of another shape, or any nearest one
+        others = [s for s in sim.stations if s is not station]
+        if not others:
+            return []
+        nearest = min(others, key=lambda s: distance2(s, station))
+        otherShapes = [s for s in others if s.shape != station.shape]
+        if otherShapes:
+            nearestOther = min(otherShapes, key=lambda s: distance2(s, station))
+            return [nearestOther] if nearestOther is nearest else [nearestOther, nearest]
+        return [nearest]
+
+    def addRollingStock(self, sim):
+        crowded = max((s for s in sim.stations if s.lines), key=lambda s: len(s.passengers), default=None)
+        if crowded is None or len(crowded.passengers) * 2 < sim.stationCapacity:
+            return
+        line = max(crowded.lines, key=lambda l: len(l.stations) / len(l.trains))
+        if sim.spareTrains > 0:
+            sim.addTrain(line, crowded)
+        elif sim.spareCarriages > 0:
+            train = min(line.trains, key=lambda t: t.carriages)
+            sim.addCarriage(train)
+
+class TreePlanner(GreedyPlanner):
+    #Grows the network like a minimum spanning tree: every station joins its nearest linked station
+    #That link extends a line when the station it joins is a line end, otherwise it opens a new line (a branch)
+    #Without colors left it falls back to the greedy moves
+    def candidates(self, sim, station):
+        linked = [s for s in sim.stations if s is not station and s.lines]
+        if not linked: #First link of the game
+            yield from super().candidates(sim, station)
+            return
+        nearest = min(linked, key=lambda s: distance2(s, station))
+        extendableLine, endpoint, _ = findExtendableLine(nearest, station)
+        if extendableLine is not None and endpoint is nearest:
+            yield 0, nearest, station, False
+            return
+        if len(sim.lines) < len(sim.colors):
+            yield 0, station, nearest, True
+            return
+        yield from super().candidates(sim, station)
+
+#Policies by name, for montecarlo.py and benchmark.py
+POLICIES = {'scripted': ScriptedPolicy, 'greedy': GreedyPlanner, 'tree': TreePlanner}
@@ -0,0 +1,72 @@
+#Times each phase of a tick (simulation and drawing) while profiling is switched on
+#In the window a tick is one frame, headless runs have no frames and tick once per simulation step with stepTicks=True
+#Keeps a rolling window per phase for the on-screen p50/p99 and a full per-call trace for saving
+#Traces open in chrome://tracing or ui.perfetto.dev (.json), or in a spreadsheet (.csv)
+
+import csv
+import json
+import os
+import time
+from collections import deque
+
+class FrameProfiler:
+    def __init__(self, window=300, maxEvents=1000000, stepTicks=False):
+        self.window = window #Ticks kept for the rolling percentiles
+        self.stepTicks = stepTicks #The simulation starts a tick on every step it runs
+        self.maxEvents = maxEvents #Trace stops growing after this many calls
+        self.history = {} #Phase -> deque of per-tick total milliseconds
+        self.totals = {} #Phase -> milliseconds spent so far in the current tick
+        self.events = [] #(tick, phase, start, duration) in seconds, one per measured call
+        self.tick = None
+        self.startTime = time.perf_counter()
+        self.stats = {}
+        self.statsTick = None
+
+    def startTick(self, tick):
+        #Totals of the tick that ended go into the rolling windows
+        if self.tick is not None:
+            for phase, total in self.totals.items():
+                self.history.setdefault(phase, deque(maxlen=self.window)).append(total)
+            for phase, samples in self.history.items():
+                if phase not in self.totals: #Phase skipped this tick
+                    samples.append(0.0)
+        self.totals = {}
+        self.tick = tick
+
+    def measure(self, phase, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            duration = time.perf_counter() - start
+            self.totals[phase] = self.totals.get(phase, 0.0) + duration * 1000
+            if len(self.events) < self.maxEvents:
+                self.events.append((self.tick, phase, start - self.startTime, duration))
+
+    def percentiles(self):
+        #Phase -> (p50, p99) in milliseconds, refreshed a few times a second so drawing stays cheap
+        if self.statsTick is None or self.tick is None or not 0 <= self.tick - self.statsTick < 15:
+            self.stats = {}
+            for phase, samples in self.history.items():
+                values = sorted(samples)
+                if values:
+                    self.stats[phase] = (values[len(values) // 2], values[min(len(values) - 1, int(len(values) * 0.99))])
+            self.statsTick = self.tick
+        return self.stats
+
+    def save(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['tick', 'phase', 'startMs', 'durationMs'])
+                for tick, phase, start, duration in self.events:
+                    writer.writerow([tick, phase, f'{start * 1000:.3f}', f'{duration * 1000:.3f}'])
+        else:
+            #Chrome trace "complete" events, timestamps in microseconds
+            trace = [{'name': phase, 'ph': 'X', 'pid': 0, 'tid': 0, 'ts': start * 1e6, 'dur': duration * 1e6,
+                      'args': {'tick': tick}} for tick, phase, start, duration in self.events]
+            with open(path, 'w') as f:
+                json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f, separators=(',', ':'))
@@ -0,0 +1,183 @@
+#Cached drawing of everything that only changes when the network changes
+#The map, tracks and station glyphs are painted into one image with PIL and reused every frame, network changes only repaint around themselves
+#Passenger glyphs of a station queue or a train are stamped the same way, one image per distinct load
+
+import math
+from cmu_graphics import CMUImage
+from PIL import Image, ImageDraw
+
+SUPERSAMPLE = 2 #Paint at double size and shrink, PIL does not antialias shapes
+
+BLANK_MAP = (235, 232, 225) #Background of maps without a picture
+
+def regularPolygonPoints(cx, cy, r, points, rotateAngle=0):
+    #Same vertices as drawRegularPolygon: first one straight up, rotateAngle turns clockwise
+    result = []
+    for i in range(points):
+        angle = math.radians(rotateAngle + i * 360 / points)
+        result.append((cx + r * math.sin(angle), cy - r * math.cos(angle)))
+    return result
+
+#Station shape -> (points, rotateAngle), circles are drawn as ellipses
+STATION_POLYGONS = {'square': (4, 45), 'triangle': (3, 0), 'diamond': (4, 0), 'pentagon': (5, 0)}
+
+def stationOutline(shape, x, y, radius, border=0):
+    #Polygon grown by border measured at the edges, not the corners
+    points, rotateAngle = STATION_POLYGONS[shape]
+    r = radius + 5 + border / math.cos(math.pi / points)
+    return regularPolygonPoints(x, y, r, points, rotateAngle)
+
+class StaticLayer:
+    #Only the part of the window around what changed since the last paint is painted again
+    #That part is painted at SUPERSAMPLE size onto a transparent overlay, shrunk and laid over the cached background
+    def __init__(self, assets, backgroundPath, width, height):
+        self.width = width
+        self.height = height
+        if backgroundPath is None: #Procedural maps have no picture
+            self.background = Image.new('RGB', (width, height), BLANK_MAP)
+        else:
+            self.background = assets.picture(backgroundPath, (width, height)) #Decoded once per map, shared between games
+        self.canvas = self.background.copy()
+        self.painted = {} #Track or station key -> its box (left, top, right, bottom) on the canvas
+        self.image = None
+        self.version = None #Topology version the cached image was painted for
+
+    def get(self, sim):
+        if self.version != sim.topologyVersion:
+            self.image = CMUImage(self.paint(sim))
+            self.version = sim.topologyVersion
+        return self.image
+
+    def items(self, sim):
+        #Key -> (box, draw function, its arguments) of every track and station, tracks first so stations go on top
+        items = {}
+        #Gemini AI - separating overlapping lines
+        for segment, lines in sim.segment_map.items():
+            s1, s2 = segment[0], segment[1]
+            for line in lines:
+                offsetX, offsetY = sim.trackOffsets[(segment, line)]
+                x1, y1, x2, y2 = s1.x + offsetX, s1.y + offsetY, s2.x + offsetX, s2.y + offsetY
+                box = (min(x1, x2) - 4, min(y1, y2) - 4, max(x1, x2) + 4, max(y1, y2) + 4)
+                items[(segment, line, offsetX, offsetY)] = (box, drawTrack, (x1, y1, x2, y2, line.color))
+        for station in sim.stations:
+            reach = station.radius + 20 #Polygons stick out past the radius
+            box = (station.x - reach, station.y - reach, station.x + reach, station.y + reach)
+            items[station] = (box, drawStation, (station,))
+        return items
+
+    def paint(self, sim):
+        items = self.items(sim)
+        #Boxes of everything added, moved (shared tracks spread out) or gone since the last paint
+        changed = [box for key, (box, _, _) in items.items() if key not in self.painted]
+        changed += [box for key, box in self.painted.items() if key not in items]
+        self.painted = {key: box for key, (box, _, _) in items.items()}
+        if not changed:
+            return self.canvas
+        left = max(0, int(min(box[0] for box in changed)))
+        top = max(0, int(min(box[1] for box in changed)))
+        right = min(self.width, int(max(box[2] for box in changed)) + 1)
+        bottom = min(self.height, int(max(box[3] for box in changed)) + 1)
+        if left >= right or top >= bottom:
+            return self.canvas
+
+        #Repaint everything touching the region, PIL clips what lies outside the overlay
+        k = SUPERSAMPLE
+        overlay = Image.new('RGBA', ((right - left) * k, (bottom - top) * k), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(overlay)
+        for box, drawItem, args in items.values():
+            if box[0] < right and box[2] > left and box[1] < bottom and box[3] > top:
+                drawItem(draw, k, left, top, *args)
+        region = self.background.crop((left, top, right, bottom)).convert('RGBA')
+        region.alpha_composite(overlay.reduce(k))
+        self.canvas.paste(region.convert('RGB'), (left, top))
+        return self.canvas
+
+#Both draw at k times size with (dx, dy) as the origin
+#Points are snapped to whole supersampled pixels before moving them, so a region rasterizes like the whole canvas does
+def snap(points, k, dx, dy):
+    return [(round(x * k) - dx * k, round(y * k) - dy * k) for x, y in points]
+
+def drawTrack(draw, k, dx, dy, x1, y1, x2, y2, color):
+    ends = snap([(x1, y1), (x2, y2)], k, dx, dy)
+    draw.line(ends, fill=color, width=5 * k)
+    #Round ends so tracks meet cleanly at stations
+    for cx, cy in ends:
+        draw.ellipse([cx - 2.5 * k, cy - 2.5 * k, cx + 2.5 * k, cy + 2.5 * k], fill=color)
+
+def drawStation(draw, k, dx, dy, station):
+    #Black border drawn as a slightly bigger shape under the white one
+    border = 1.5
+    if station.shape not in STATION_POLYGONS:
+        x, y, r = station.x * k - dx * k, station.y * k - dy * k, station.radius * k
+        draw.ellipse([x - r - border * k, y - r - border * k, x + r + border * k, y + r + border * k], fill='black')
+        draw.ellipse([x - r + border * k, y - r + border * k, x + r - border * k, y + r - border * k], fill='white')
+    else:
+        outer = stationOutline(station.shape, station.x, station.y, station.radius, border)
+        inner = stationOutline(station.shape, station.x, station.y, station.radius, -border)
+        draw.polygon(snap(outer, k, dx, dy), fill='black')
+        draw.polygon(snap(inner, k, dx, dy), fill='white')
+
+#Passenger shape -> (radius, points, rotateAngle, yShift) for station queues and trains, circles have no points
+WAITING_GLYPHS = {'circle': (4.5, 0, 0, 0), 'square': (6, 4, 45, 0), 'triangle': (6, 3, 0, 1),
+                  'diamond': (6, 4, 0, 0), 'pentagon': (5, 5, 0, 0)}
+RIDING_GLYPHS = {'circle': (3, 0, 0, 0), 'square': (4, 4, 45, 0), 'triangle': (4, 3, 0, 0),
+                 'diamond': (4, 4, 0, 0), 'pentagon': (4, 5, 0, 0)}
+STAMP_PADDING = 7 #Room around the outermost glyph centres
+STAMP_CACHE_LIMIT = 4096
+
+class PassengerStamps:
+    #Whole passenger grids prerendered into small images, keyed by what they show
+    #A frame then draws one image per station queue and per train instead of one shape per passenger
+    def __init__(self):
+        self.stamps = {}
+
+    def stamp(self, key, paint):
+        image = self.stamps.get(key)
+        if image is None:
+            if len(self.stamps) >= STAMP_CACHE_LIMIT: #Loads come and go, start over rather than grow forever
+                self.stamps.clear()
+            image = self.stamps[key] = CMUImage(paint())
+        return image
+
+    def waiting(self, shapes):
+        #Queue grid five wide, returned with the offset of its top left corner from the station centre
+        pad = STAMP_PADDING
+        rows = (len(shapes) + 4) // 5
+        image = self.stamp(('waiting', shapes), lambda: self.paint(
+            shapes, 5, 10, 10, 40 + 2 * pad, (rows - 1) * 10 + 2 * pad, WAITING_GLYPHS, 'gray'))
+        return image, -20 - pad, 30 - pad
+
+    def riding(self, shapes, color, carriages):
+        #Train body with its riders, three seats per carriage in each row, offset from the train centre
+        pad = STAMP_PADDING
+        width = 30 * carriages
+        def paint():
+            canvas, draw = self.canvas(width + 2 * pad, 14 + 2 * pad)
+            k = SUPERSAMPLE
+            draw.rectangle([(pad - 1) * k, (pad - 1) * k, (pad + width + 1) * k, (pad + 15) * k], fill='black')
+            draw.rectangle([(pad + 1) * k, (pad + 1) * k, (pad + width - 1) * k, (pad + 13) * k], fill=color)
+            self.paintGlyphs(draw, shapes, 3 * carriages, 10, 8, pad + 5, pad + 3, RIDING_GLYPHS, 'white')
+            return self.shrink(canvas)
+        return self.stamp(('riding', shapes, color, carriages), paint), -width / 2 - pad, -7 - pad
+
+    def paint(self, shapes, columns, dx, dy, width, height, glyphs, fill):
+        canvas, draw = self.canvas(width, height)
+        self.paintGlyphs(draw, shapes, columns, dx, dy, STAMP_PADDING, STAMP_PADDING, glyphs, fill)
+        return self.shrink(canvas)
+
+    def canvas(self, width, height):
+        canvas = Image.new('RGBA', (int(width) * SUPERSAMPLE, int(height) * SUPERSAMPLE), (0, 0, 0, 0))
+        return canvas, ImageDraw.Draw(canvas)
+
+    def shrink(self, canvas):
+        return canvas.resize((canvas.width // SUPERSAMPLE, canvas.height // SUPERSAMPLE), Image.LANCZOS)
+
+    def paintGlyphs(self, draw, shapes, columns, dx, dy, left, top, glyphs, fill):
+        k = SUPERSAMPLE
+        for i, shape in enumerate(shapes):
+            r, points, rotateAngle, yShift = glyphs[shape]
+            x, y = left + (i % columns) * dx, top + (i // columns) * dy + yShift
+            if points == 0:
+                draw.ellipse([(x - r) * k, (y - r) * k, (x + r) * k, (y + r) * k], fill=fill)
+            else:
+                draw.polygon([(px * k, py * k) for px, py in regularPolygonPoints(x, y, r, points, rotateAngle)], fill=fill)
@@ -0,0 +1,95 @@
+#Replays store a game's map, difficulty, seed and timestamped player actions
+#Playing one back re-runs the whole game headlessly, as fast as the simulation can step
+#Usage: python replay.py replays/<file>.json [...]
+
+import json
+import os
+import sys
+import time
+from collections import deque
+from simulation import Simulation, DEMANDS, demandName
+
+REPLAY_VERSION = 3 #2: passengers whose stop comes before the train turns around board first, 3: demand preset recorded
+
+def saveReplay(sim, path):
+    replay = {
+        'version': REPLAY_VERSION,
+        'map': sim.mapName,
+        'difficulty': sim.difficulty,
+        'seed': sim.seed,
+        'width': sim.width,
+        'height': sim.height,
+        'routing': sim.routing,
+        'demand': demandName(sim.demand),
+        'actions': [[timer, kind, *args] for timer, kind, args in sim.actions],
+        #Result when recorded, playback should end up with the same numbers
+        'timer': sim.timer,
+        'passengersTrips': sim.passengersTrips,
+        'gameOver': sim.gameOver,
+    }
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(replay, f, separators=(',', ':'))
+
+def loadReplay(path):
+    with open(path) as f:
+        replay = json.load(f)
+    if replay.get('version') != REPLAY_VERSION:
+        raise ValueError(f"{path}: unsupported replay version {replay.get('version')}")
+    return replay
+
+def applyAction(sim, action):
+    kind, args = action[1], action[2:]
+    if kind == 'connect':
+        station1, station2, forceNewLine = args
+        sim.connect(sim.stations[station1], sim.stations[station2], forceNewLine)
+    elif kind == 'pause':
+        sim.togglePause()
+    elif kind == 'train':
+        line, station = args
+        sim.addTrain(sim.lines[line], sim.stations[station])
+    elif kind == 'carriage':
+        line, train = args
+        sim.addCarriage(sim.lines[line].trains[train])
+    else:
+        raise ValueError(f'Unknown replay action: {kind}')
+
+def playReplay(replay, maxSteps=None):
+    #Actions recorded at timer t happened after step t, so they go in before the next step
+    sim = Simulation(replay['map'], replay['difficulty'], replay['seed'], replay['width'], replay['height'],
+                     demand=DEMANDS[replay['demand']], routing=replay['routing'])
+    if maxSteps is None:
+        maxSteps = replay['timer']
+    actions = deque(replay['actions'])
+    while sim.timer < maxSteps and not sim.gameOver:
+        while actions and actions[0][0] <= sim.timer:
+            applyAction(sim, actions.popleft())
+        sim.advance(min(actions[0][0], maxSteps) if actions else maxSteps)
+    while actions and actions[0][0] <= sim.timer: #Actions after the last step
+        applyAction(sim, actions.popleft())
+    return sim
+
+def checkReplay(path):
+    replay = loadReplay(path)
+    startTime = time.perf_counter()
+    sim = playReplay(replay)
+    elapsed = time.perf_counter() - startTime
+    matches = (sim.timer, sim.passengersTrips, sim.gameOver) == (replay['timer'], replay['passengersTrips'], replay['gameOver'])
+    ending = f'game over at step {sim.timer}' if sim.gameOver else f'stopped at step {sim.timer}'
+    print(f"{path}: {replay['map']} {replay['difficulty']}, {sim.passengersTrips} trips, {ending}, "
+          f"{elapsed:.2f}s ({'OK' if matches else 'MISMATCH'})")
+    if not matches:
+        print(f"  recorded {replay['passengersTrips']} trips, step {replay['timer']}, game over {replay['gameOver']}")
+    return matches
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage: python replay.py replays/<file>.json [...]')
+        sys.exit(2)
+    results = [checkReplay(path) for path in sys.argv[1:]]
+    sys.exit(0 if all(results) else 1)
+
+if __name__ == '__main__':
+    main()
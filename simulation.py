@@ -0,0 +1,1100 @@
+#Headless game logic for Micro Metro
+#Nothing in here imports cmu_graphics, so games can be stepped without a window, images or sound
+
+import bisect
+import heapq
+import random
+from array import array
+from collections import deque
+from mapgen import poissonDisk
+
+#Simulation steps per second of game time, however fast the game is drawn
+STEPS_PER_SECOND = 60
+
+#Difficulty presets, all rates are counted in steps (60 steps = 1 second)
+DIFFICULTIES = {
+    'Easy': {
+        'passengerSpawnRate': 140, #Starts every 2.33 seconds, gradually increases in freq
+        'stationSpawnRate': 660, #Every 11 seconds
+        'stationLimit': 20,
+        'spawnLimit': 30,
+        'stationCapacity': 10,
+        'spareTrains': 3, #Extra trains the player can put on lines
+        'spareCarriages': 3, #Extra carriages the player can hook onto trains
+        'shapes': ['circle', 'square', 'triangle'],
+        'colors': ['red', 'blue', 'green', 'orange', 'purple']},
+    'Medium': {
+        'passengerSpawnRate': 100, #Starts every 1.67 seconds, gradually increases in freq
+        'stationSpawnRate': 600, #Every 10 seconds
+        'stationLimit': 20,
+        'spawnLimit': 20,
+        'stationCapacity': 8,
+        'spareTrains': 2,
+        'spareCarriages': 2,
+        'shapes': ['circle', 'square', 'triangle', 'diamond', 'pentagon'],
+        'colors': ['red', 'blue', 'green', 'orange', 'purple']},
+    'Hard': {
+        'passengerSpawnRate': 80, #Starts every 1.33 seconds, gradually increases in freq
+        'stationSpawnRate': 540, #Every 9 seconds
+        'stationLimit': 30,
+        'spawnLimit': 10,
+        'stationCapacity': 8,
+        'spareTrains': 1,
+        'spareCarriages': 1,
+        'shapes': ['circle', 'square', 'triangle', 'diamond', 'pentagon'],
+        'colors': ['red', 'blue', 'green']},
+    'Stress': { #Hundreds of stations on a procedural map, for finding what stops scaling
+        'passengerSpawnRate': 60,
+        'stationSpawnRate': 30, #Two stations a second
+        'stationLimit': 5000,
+        'spawnLimit': 10,
+        'stationCapacity': 12,
+        'spareTrains': 100,
+        'spareCarriages': 100,
+        'shapes': ['circle', 'square', 'triangle', 'diamond', 'pentagon'],
+        'colors': ['red', 'blue', 'green', 'orange', 'purple', 'brown', 'teal', 'gold', 'crimson', 'navy',
+                   'olive', 'magenta', 'darkCyan', 'chocolate', 'indigo', 'limeGreen', 'deepPink', 'steelBlue',
+                   'darkOrange', 'seaGreen', 'sienna', 'darkViolet', 'royalBlue', 'tomato', 'darkGoldenrod',
+                   'mediumVioletRed', 'cadetBlue', 'darkOliveGreen', 'slateBlue', 'fireBrick', 'darkSlateGray',
+                   'hotPink', 'forestGreen', 'dodgerBlue', 'maroon', 'darkKhaki', 'orchid', 'peru', 'darkSalmon', 'slateGray']},
+}
+
+#Gap between lines sharing a track
+TRACK_SPACING = 8
+
+#Passengers one carriage holds, every train starts with one
+CARRIAGE_CAPACITY = 6
+
+#Steps a train stands at a station
+DWELL_STEPS = 60 #1 second
+
+#Distance a train covers per step
+TRAIN_SPEED = 1.5
+
+#Steps a route is charged for changing lines, roughly the wait for a train on the new line
+TRANSFER_STEPS = 300 #5 seconds
+
+#Difficulty ramps happen this often, each one makes passengers spawn a step sooner
+RAMP_STEPS = 180
+
+#Order of events due on the same step, trains go between the ramp and the spawns
+RAMP, PASSENGER_SPAWN, STATION_SPAWN = 0, 1, 2
+
+#Starting stations of each map
+MAPS = {
+    'New York': [(650, 500, 'circle'), (900, 300, 'square'), (950, 700, 'triangle')],
+    'Tokyo': [(600, 600, 'circle'), (800, 300, 'square'), (1100, 400, 'triangle')],
+    'Hong Kong': [(600, 400, 'circle'), (1200, 500, 'square'), (900, 600, 'triangle')],
+}
+
+#Map whose stations sit on Poisson-disk sites generated from the seed, see mapgen.py
+PROCEDURAL_MAP = 'Procedural'
+SITE_SPACING = 50 #Closest two procedural stations can be
+
+#Gemini AI designed this breadth first search function to find a transfer path if line does not reach target
+#Also imported deque
+def findPathBFS(startStation, destinationShape):
+    queue = deque([(startStation, [startStation])])
+    visited = {startStation}
+
+    if startStation.shape == destinationShape:
+        return [startStation]
+
+    while queue:
+        currentHeading, path = queue.popleft()
+
+        # Find adjacent stations to currentHeading
+        neighbors = set()
+        for line in currentHeading.lines:
+            try:
+                idx = line.stations.index(currentHeading)
+                if idx > 0:
+                    neighbors.add(line.stations[idx - 1])
+                if idx < len(line.stations) - 1:
+                    neighbors.add(line.stations[idx + 1])
+            except ValueError:
+                continue
+
+        for neighbor in neighbors:
+            if neighbor not in visited:
+                new_path = path + [neighbor]
+                if neighbor.shape == destinationShape:
+                    return new_path  # Found the shortest path
+
+                visited.add(neighbor)
+                queue.append((neighbor, new_path))
+
+    return None  # No path found
+
+def findTransfer(startStation, destinationShape):
+    path = findPathBFS(startStation, destinationShape)
+    #Return list of stations to pass through
+    if not path or len(path) < 3: #No transfer needed, curr or next station is destination
+        return None
+    currentLines = set(path[0].lines) & set(path[1].lines) #Current possible lines
+    #Iterate through the path returned to find whether transfer is need
+    for i in range(1, len(path) - 1):
+        currentHeading = path[i]
+        nextHeading = path[i+1]
+        nextLines = set(currentHeading.lines) & set(nextHeading.lines) #Possible lines afterwards
+        if not currentLines & nextLines: #No single line possible
+            return currentHeading
+        currentLines = currentLines & nextLines
+    #No transfer needed
+    return None
+
+class TopologyEvents:
+    #Tells the indexes derived from the network what changed, each event bumps the version
+    #Events: ('stationAdded', station), ('segmentAdded', line, s1, s2), ('reset',) when the whole network was replaced
+    def __init__(self):
+        self.version = 0
+        self.subscribers = [] #Called with (kind, *args) in subscription order
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def publish(self, kind, *args):
+        self.version += 1
+        for callback in self.subscribers:
+            callback(kind, *args)
+
+class RoutingTable:
+    #Same answers as findTransfer, but built once per destination shape instead of once per passenger
+    #Thrown away when a segment is added, a station on its own can't be routed through yet
+    def __init__(self, stations, lines):
+        self.stations = stations
+        self.lines = lines
+        self.neighbors = None #Station -> adjacent stations, in line order so results are repeatable
+        self.transfers = {} #Shape code -> {station: transfer station or None}
+
+    def invalidate(self):
+        self.neighbors = None
+        self.transfers.clear()
+
+    def topologyChanged(self, kind, *args):
+        if kind != 'stationAdded':
+            self.invalidate()
+
+    def nextTransfer(self, station, destinationCode):
+        table = self.transfers.get(destinationCode)
+        if table is None:
+            table = self.buildTable(destinationCode)
+            self.transfers[destinationCode] = table
+        return table.get(station)
+
+    def buildNeighbors(self):
+        neighbors = {station: [] for station in self.stations}
+        for line in self.lines:
+            for i in range(len(line.stations) - 1):
+                s1, s2 = line.stations[i], line.stations[i+1]
+                if s2 not in neighbors[s1]:
+                    neighbors[s1].append(s2)
+                    neighbors[s2].append(s1)
+        return neighbors
+
+    def buildTable(self, destinationCode):
+        if self.neighbors is None:
+            self.neighbors = self.buildNeighbors()
+        #BFS outwards from every destination at once, nextHop points one step closer to the nearest one
+        nextHop = {}
+        queue = deque()
+        for station in self.stations:
+            if station.shapeCode == destinationCode:
+                nextHop[station] = None
+                queue.append(station)
+        while queue:
+            current = queue.popleft()
+            for neighbor in self.neighbors.get(current, ()):
+                if neighbor not in nextHop:
+                    nextHop[neighbor] = current
+                    queue.append(neighbor)
+
+        table = {}
+        for station in nextHop:
+            table[station] = self.findTransferOnPath(station, nextHop)
+        return table
+
+    def findTransferOnPath(self, station, nextHop):
+        #Same walk as findTransfer, following nextHop instead of a stored path
+        current = nextHop[station]
+        if current is None or nextHop[current] is None: #Curr or next station is destination
+            return None
+        currentLines = set(station.lines) & set(current.lines)
+        while nextHop[current] is not None:
+            nextLines = set(current.lines) & set(nextHop[current].lines)
+            if not currentLines & nextLines: #No single line possible
+                return current
+            currentLines = currentLines & nextLines
+            current = nextHop[current]
+        return None
+
+class TimedRoutingTable(RoutingTable):
+    #Fastest route instead of fewest stops: Dijkstra over (station, line) states
+    #Riding a segment costs its length in steps plus the dwell at the next stop, changing lines costs TRANSFER_STEPS
+    def __init__(self, stations, lines):
+        super().__init__(stations, lines)
+        self.moves = None #(station, line) -> [(station, line, steps)] of every move out of that state
+
+    def invalidate(self):
+        super().invalidate()
+        self.moves = None
+
+    def buildMoves(self):
+        moves = {}
+        for line in self.lines:
+            for i, station in enumerate(line.stations):
+                stateMoves = []
+                for j in (i - 1, i + 1): #Ride to a neighbouring stop of the same line
+                    if 0 <= j < len(line.stations):
+                        neighbor = line.stations[j]
+                        distance = ((neighbor.x - station.x)**2 + (neighbor.y - station.y)**2)**0.5
+                        stateMoves.append((neighbor, line, distance / TRAIN_SPEED + DWELL_STEPS))
+                for other in station.lines: #Change lines here
+                    if other is not line:
+                        stateMoves.append((station, other, TRANSFER_STEPS))
+                moves[(station, line)] = stateMoves
+        return moves
+
+    def buildTable(self, destinationCode):
+        if self.moves is None:
+            self.moves = self.buildMoves()
+        #Search backwards from every destination at once, routes cost the same both ways
+        #nextState points one state closer to the nearest destination
+        cost = {}
+        nextState = {}
+        heap = []
+        pushed = 0
+        for station in self.stations:
+            if station.shapeCode == destinationCode:
+                for line in station.lines:
+                    cost[(station, line)] = 0
+                    nextState[(station, line)] = None
+                    heap.append((0, pushed, station, line))
+                    pushed += 1
+        heapq.heapify(heap)
+        transfer = {} #State -> first station where its route changes lines, None for none, filled in as states settle
+        while heap:
+            steps, _, station, line = heapq.heappop(heap)
+            if (station, line) in transfer:
+                continue
+            after = nextState[(station, line)] #Settled before this one
+            if after is None:
+                transfer[(station, line)] = None
+            elif after[1] is not line:
+                transfer[(station, line)] = station
+            else:
+                transfer[(station, line)] = transfer[after]
+            for neighbor, neighborLine, moveSteps in self.moves[(station, line)]:
+                state = (neighbor, neighborLine)
+                if state not in transfer and steps + moveSteps < cost.get(state, float('inf')):
+                    cost[state] = steps + moveSteps
+                    nextState[state] = (station, line)
+                    heapq.heappush(heap, (steps + moveSteps, pushed, neighbor, neighborLine))
+                    pushed += 1
+
+        #Passengers board the line with the fastest route from their station
+        table = {}
+        for station in self.stations:
+            best = None
+            for line in station.lines:
+                if (station, line) in cost and (best is None or cost[(station, line)] < cost[best]):
+                    best = (station, line)
+            if best:
+                table[station] = transfer[best]
+        return table
+
+#Routers by name, 'hops' is the original fewest-stops routing
+ROUTINGS = {'hops': RoutingTable, 'time': TimedRoutingTable}
+
+class SpatialGrid:
+    #Buckets stations into square cells so point and radius queries only look at nearby cells
+    def __init__(self, cellSize):
+        self.cellSize = cellSize
+        self.cells = {} #(column, row) -> stations in that cell
+        self.maxRadius = 0
+
+    def cellOf(self, x, y):
+        return (int(x // self.cellSize), int(y // self.cellSize))
+
+    def add(self, station):
+        self.cells.setdefault(self.cellOf(station.x, station.y), []).append(station)
+        self.maxRadius = max(self.maxRadius, station.radius)
+
+    def near(self, x, y, radius):
+        #Stations whose centre is less than radius away from (x, y)
+        left, top = self.cellOf(x - radius, y - radius)
+        right, bottom = self.cellOf(x + radius, y + radius)
+        found = []
+        for column in range(left, right + 1):
+            for row in range(top, bottom + 1):
+                for station in self.cells.get((column, row), ()):
+                    if (station.x - x)**2 + (station.y - y)**2 < radius**2:
+                        found.append(station)
+        return found
+
+    def stationAt(self, x, y):
+        for station in self.near(x, y, self.maxRadius):
+            if (station.x - x)**2 + (station.y - y)**2 < station.radius**2:
+                return station
+        return None
+
+class Demand:
+    #Optional spawn weighting: busier map regions and rush hours
+    def __init__(self, regions=(), rushHours=(), period=3600):
+        self.regions = list(regions) #((left, top, right, bottom), weight), weights multiply where regions overlap
+        self.rushHours = list(rushHours) #(start, end, passengers per spawn), in steps into each period
+        self.period = period
+
+    def weight(self, station):
+        #How often passengers start at station and head for it, relative to 1 for a quiet station
+        weight = 1.0
+        for (left, top, right, bottom), regionWeight in self.regions:
+            if left <= station.x <= right and top <= station.y <= bottom:
+                weight *= regionWeight
+        return weight
+
+    def passengersAt(self, step):
+        phase = step % self.period
+        for start, end, passengers in self.rushHours:
+            if start <= phase < end:
+                return passengers
+        return 1
+
+#Named demand presets for headless runs, None spawns evenly like the original game
+DEMANDS = {
+    'uniform': None,
+    'downtown': Demand(regions=[((500, 250, 1100, 650), 4)]),
+    'rushHour': Demand(rushHours=[(0, 600, 2), (1800, 2400, 3)]),
+}
+
+def demandName(demand):
+    #Name of the DEMANDS preset demand is, replays and snapshots record presets by name
+    for name, preset in DEMANDS.items():
+        if preset is demand:
+            return name
+    raise ValueError('Only DEMANDS presets can be saved')
+
+class SpawnModel:
+    #Picks where new passengers start and where they are headed
+    #Running weight totals are extended as stations appear, so a spawn is a bisect instead of a scan of every station
+    def __init__(self, demand=None):
+        self.demand = demand
+        self.stations = []
+        self.originTotals = [] #Cumulative origin weights, in station order
+        self.others = {} #Shape code -> stations of every other shape, in station order
+        self.otherTotals = {} #Shape code -> cumulative weights of those stations
+
+    def weight(self, station):
+        return self.demand.weight(station) if self.demand else 1.0
+
+    def add(self, station):
+        weight = self.weight(station)
+        self.stations.append(station)
+        self.originTotals.append((self.originTotals[-1] if self.originTotals else 0) + weight)
+        code = station.shapeCode
+        if code not in self.others: #First station of its shape
+            self.others[code] = []
+            self.otherTotals[code] = []
+            for other in self.stations[:-1]:
+                self.append(code, other, self.weight(other))
+        for otherCode in self.others:
+            if otherCode != code:
+                self.append(otherCode, station, weight)
+
+    def append(self, code, station, weight):
+        totals = self.otherTotals[code]
+        self.others[code].append(station)
+        totals.append((totals[-1] if totals else 0) + weight)
+
+    def sample(self, rng):
+        #(start station, destination shape code), destination None when every station has the start's shape
+        if self.demand is None or not self.demand.regions:
+            #Even weights draw exactly like the original choice over every station
+            startStation = rng.choice(self.stations)
+            others = self.others[startStation.shapeCode]
+            return startStation, rng.choice(others).shapeCode if others else None
+        startStation = rng.choices(self.stations, cum_weights=self.originTotals)[0]
+        others = self.others[startStation.shapeCode]
+        if not others:
+            return startStation, None
+        return startStation, rng.choices(others, cum_weights=self.otherTotals[startStation.shapeCode])[0].shapeCode
+
+class Scheduler:
+    #Priority queue of actions due on a given step, ties go by priority and then by push order
+    def __init__(self):
+        self.heap = []
+        self.pushed = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, step, priority, action):
+        heapq.heappush(self.heap, (step, priority, self.pushed, action))
+        self.pushed += 1
+
+    def nextStep(self):
+        return self.heap[0][0] if self.heap else None
+
+    def runDue(self, step, maxPriority=None):
+        #Runs every action due by step, or only those up to maxPriority
+        while self.heap and self.heap[0][0] <= step and (maxPriority is None or self.heap[0][1] <= maxPriority):
+            heapq.heappop(self.heap)[3]()
+
+    def clear(self):
+        self.heap.clear()
+
+#Gemini AI - shared tracks are keyed by their two stations in a fixed order
+def segmentKey(s1, s2):
+    return tuple(sorted((s1, s2), key=id))
+
+def findExtendableLine(station1, station2):
+    #Priority for first selected station
+    #Checks if first selected line is valid
+    for line in station1.lines:
+        endpoints = line.getEndpoints()
+        if len(endpoints) == 2 and station1 in endpoints and not line.hasStation(station2):
+            return line, station1, station2
+
+    #Checks if second selected line is valid
+    for line in station2.lines:
+        endpoints = line.getEndpoints()
+        if len(endpoints) == 2 and station2 in endpoints and not line.hasStation(station1):
+            return line, station2, station1
+
+    return None, None, None
+
+
+#Shapes as small ints, so passengers store a code and hot loops compare ints
+#Fixed for every simulation in the process, so codes mean the same in every game
+SHAPES = ('circle', 'square', 'triangle', 'diamond', 'pentagon') #Code -> shape
+SHAPE_CODES = {shape: code for code, shape in enumerate(SHAPES)}
+
+def shapeCode(shape):
+    code = SHAPE_CODES.get(shape)
+    if code is None:
+        raise ValueError(f'Unknown shape: {shape}')
+    return code
+
+class QueueBucket:
+    #Passengers of one shape in arrival order, tickets in an int array next to them
+    #Taken passengers only move the head, the used front is cut off once it is half the bucket
+    __slots__ = ('tickets', 'passengers', 'head')
+
+    def __init__(self):
+        self.tickets = array('q')
+        self.passengers = []
+        self.head = 0
+
+    def __len__(self):
+        return len(self.passengers) - self.head
+
+    def append(self, ticket, passenger):
+        self.tickets.append(ticket)
+        self.passengers.append(passenger)
+
+    def firstTicket(self):
+        return self.tickets[self.head]
+
+    def popleft(self):
+        passenger = self.passengers[self.head]
+        self.passengers[self.head] = None
+        self.head += 1
+        if self.head >= 32 and self.head * 2 >= len(self.passengers):
+            del self.tickets[:self.head]
+            del self.passengers[:self.head]
+            self.head = 0
+        return passenger
+
+    def entries(self):
+        return zip(self.tickets[self.head:], self.passengers[self.head:])
+
+class PassengerQueue:
+    #Waiting passengers bucketed by destination shape code, so a train only looks at the shapes it can take
+    #Every passenger gets a ticket number, boarding across buckets still goes first come first served
+    __slots__ = ('buckets', 'count', 'nextTicket')
+
+    def __init__(self):
+        self.buckets = {} #Shape code -> QueueBucket
+        self.count = 0
+        self.nextTicket = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        #Passengers in arrival order
+        merged = heapq.merge(*(bucket.entries() for bucket in self.buckets.values()), key=lambda entry: entry[0])
+        return (passenger for _, passenger in merged)
+
+    def append(self, passenger):
+        bucket = self.buckets.get(passenger.shapeCode)
+        if bucket is None:
+            bucket = self.buckets[passenger.shapeCode] = QueueBucket()
+        bucket.append(self.nextTicket, passenger)
+        self.nextTicket += 1
+        self.count += 1
+
+    def shapeCodes(self):
+        return [code for code, bucket in self.buckets.items() if bucket]
+
+    def take(self, codes, limit):
+        #Removes and returns up to limit of the earliest passengers heading for any of the shape codes
+        buckets = [self.buckets[code] for code in codes if self.buckets.get(code)]
+        taken = []
+        while buckets and len(taken) < limit:
+            earliest = min(buckets, key=QueueBucket.firstTicket)
+            taken.append(earliest.popleft())
+            if not earliest:
+                buckets.remove(earliest)
+        self.count -= len(taken)
+        return taken
+
+class Station:
+    __slots__ = ('x', 'y', 'shape', 'shapeCode', 'passengers', 'lines', 'radius')
+
+    def __init__(self, x, y, shape):
+        self.x = x
+        self.y = y
+        self.shape = shape
+        self.shapeCode = shapeCode(shape)
+        self.passengers = PassengerQueue()
+        self.lines = []
+        self.radius = 20
+
+class Passenger:
+    #Passenger shape is determined by the destination
+    __slots__ = ('shapeCode', 'transferStation', 'spawnStep')
+
+    def __init__(self, destinationCode, spawnStep=None):
+        self.shapeCode = destinationCode #Code of the destination shape, see shapeCode
+        self.transferStation = None  #Station where passenger should transfer
+        self.spawnStep = spawnStep #Step the passenger appeared, for trip times
+
+    @property
+    def destinationShape(self):
+        return SHAPES[self.shapeCode]
+
+class Line:
+    __slots__ = ('stations', 'color', 'trains', 'network', 'number', 'stops', 'shapeStops', 'firstStop')
+
+    def __init__(self, color, network=None):
+        self.stations = []
+        self.color = color
+        self.trains = []
+        self.network = network #Simulation to tell about topology changes
+        self.number = len(network.lines) if network else 0 #Position in the simulation's lines
+        #Stops are numbered as they join, stations added at the front count down from firstStop
+        #so a station's index in self.stations is its stop number minus firstStop
+        self.stops = {} #Station -> stop number
+        self.shapeStops = {} #Shape code -> sorted stop numbers of the stations with that shape
+        self.firstStop = 0
+
+    def indexStop(self, station, number):
+        self.stops[station] = number
+        bisect.insort(self.shapeStops.setdefault(station.shapeCode, []), number)
+
+    def hasStation(self, station):
+        return station in self.stops
+
+    def indexOf(self, station):
+        return self.stops[station] - self.firstStop
+
+    def reaches(self, code):
+        return code in self.shapeStops
+
+    def shapeAhead(self, code, index, direction):
+        #Whether a station with the shape code lies past index when travelling in direction
+        stops = self.shapeStops.get(code)
+        if not stops:
+            return False
+        if direction > 0:
+            return stops[-1] - self.firstStop > index
+        return stops[0] - self.firstStop < index
+
+    def linkStation(self, station): #Create a line
+        if not self.hasStation(station): #You cant add the same station twice for a line
+            self.stations.append(station) #Adds station to line
+            self.indexStop(station, self.firstStop + len(self.stations) - 1)
+            station.lines.append(self) #Adds line to station
+            #Condition for train existing
+            if len(self.stations) == 2:
+                self.addTrain(0)
+            if self.network and len(self.stations) >= 2:
+                self.network.segmentAdded(self, self.stations[-2], station)
+
+    def extendLine(self, newStation, endStation): #Extend a line
+        if self.hasStation(newStation) or endStation not in self.getEndpoints(): #Wrong conditions
+            return
+        if self.stations[0] == endStation: #Beginning of line
+            self.stations.insert(0, newStation)
+            self.firstStop -= 1
+            self.indexStop(newStation, self.firstStop)
+            for train in self.trains: #Adjust relative train position
+                train.currentIndex += 1
+                train.targetIndex += 1
+        elif self.stations[-1] == endStation: #End of line
+            self.stations.append(newStation)
+            self.indexStop(newStation, self.firstStop + len(self.stations) - 1)
+        newStation.lines.append(self)
+        if self.network:
+            self.network.segmentAdded(self, endStation, newStation)
+
+    def getEndpoints(self):
+        return [self.stations[0], self.stations[-1]]
+
+    def addTrain(self, startIndex):
+        train = Train(self, startIndex)
+        self.trains.append(train)
+        return train
+
+class Train:
+    #Moves at a constant speed from station to station, so where it is on any step follows from when it left
+    #Only arrivals are events, positions are worked out when something asks for them
+    __slots__ = ('line', 'currentIndex', 'passengers', 'carriages', 'capacity', 'direction', 'targetIndex', 'speed',
+                 'order', 'trip', 'fromX', 'fromY', 'stepX', 'stepY', 'departStep', 'arriveStep')
+
+    def __init__(self, line, startIndex):
+        self.line = line
+        self.currentIndex = startIndex #Station train is from
+        self.passengers = []
+        self.carriages = 1
+        self.capacity = CARRIAGE_CAPACITY
+        self.direction = 1 if startIndex < len(self.line.stations) - 1 else -1 #Trains placed on the last station head back
+        self.targetIndex = startIndex + self.direction
+        self.speed = TRAIN_SPEED
+        self.order = (line.number, len(line.trains)) #Trains arriving on the same step are served in this order
+        self.trip = 0 #Counts departures, so events of a replaced schedule are ignored
+        station = self.line.stations[startIndex]
+        self.depart(station.x, station.y, self.clock() + 1) #Moves on the next step
+
+    def clock(self):
+        return self.line.network.motionTimer if self.line.network else 0
+
+    def depart(self, x, y, departStep):
+        #Leaves (x, y) for the target station, the first move is on departStep
+        target = self.line.stations[self.targetIndex]
+        dx, dy = target.x - x, target.y - y
+        distance = (dx**2 + dy**2)**0.5
+        self.fromX, self.fromY = x, y
+        self.stepX, self.stepY = (self.speed * dx / distance, self.speed * dy / distance) if distance else (0, 0)
+        self.departStep = departStep
+        #Full moves until the target is less than one move away, the step after that snaps onto it
+        self.arriveStep = departStep + int(distance // self.speed)
+        self.trip += 1
+        if self.line.network:
+            self.line.network.trainScheduled(self)
+
+    def positionAt(self, step):
+        #Where the train is after step, fractions place it between two steps for drawing
+        moves = step - self.departStep + 1
+        lastMove = self.arriveStep - self.departStep
+        if moves <= 0: #Still standing
+            return self.fromX, self.fromY
+        if moves <= lastMove:
+            return self.fromX + self.stepX * moves, self.fromY + self.stepY * moves
+        #Between the last full move and snapping onto the target
+        target = self.line.stations[self.targetIndex]
+        x, y = self.fromX + self.stepX * lastMove, self.fromY + self.stepY * lastMove
+        t = min(1, moves - lastMove)
+        return x + (target.x - x) * t, y + (target.y - y) * t
+
+    @property
+    def x(self):
+        return self.positionAt(self.clock())[0]
+
+    @property
+    def y(self):
+        return self.positionAt(self.clock())[1]
+
+    @property
+    def waitTimer(self):
+        #Steps left standing at the station
+        return max(0, self.departStep - 1 - self.clock())
+
+    def addCarriage(self):
+        self.carriages += 1
+        self.capacity += CARRIAGE_CAPACITY
+
+    def arrive(self):
+        #Train is standing on its target station, serve it and head for the next one
+        station = self.line.stations[self.targetIndex]
+        self.currentIndex = self.targetIndex
+        if self.line.network:
+            deliveredCount = self.line.network.phase('handlePassengers', self.handlePassengers)
+        else:
+            deliveredCount = self.handlePassengers()
+        #Flip directions at ends
+        if self.targetIndex == len(self.line.stations) - 1:
+            self.direction = -1
+        elif self.targetIndex == 0:
+            self.direction = 1
+        self.targetIndex += self.direction
+        if self.line.network and self.line.network.metrics is not None:
+            self.line.network.metrics.departed(self, station, self.line.stations[self.targetIndex])
+        self.depart(station.x, station.y, self.arriveStep + DWELL_STEPS + 1)
+        return deliveredCount
+
+    #Drop and take passengers
+    def handlePassengers(self):
+        deliveredCount = 0
+        currentStation = self.line.stations[self.currentIndex]
+        network = self.line.network
+        metrics = network.metrics if network else None
+        #Drop off passengers at their right shape, and passengers who need to transfer here
+        remainingPassengers = []
+        stationCode = currentStation.shapeCode
+        for passenger in self.passengers:
+            if passenger.shapeCode == stationCode:
+                deliveredCount += 1 #Reached! add count
+                if metrics is not None:
+                    metrics.tripEnded(passenger, network.timer)
+            elif passenger.transferStation == currentStation:
+                passenger.transferStation = None
+                currentStation.passengers.append(passenger)
+                if network:
+                    network.queueGrew(currentStation)
+            else:
+                remainingPassengers.append(passenger)
+        self.passengers = remainingPassengers
+
+        #Pick up passengers from the station
+        space = self.capacity - len(self.passengers)
+        if space <= 0 or not currentStation.passengers:
+            return deliveredCount
+        #Whether a passenger can board only depends on their destination, so decide once per shape
+        #Passengers whose stop comes up before the train turns around get the seats first
+        if self.currentIndex == len(self.line.stations) - 1:
+            direction = -1
+        elif self.currentIndex == 0:
+            direction = 1
+        else:
+            direction = self.direction
+        boarding = {} #Shape code -> transfer station, None for a direct route
+        ahead, behind = [], []
+        for code in currentStation.passengers.shapeCodes():
+            if self.line.reaches(code): #Direct route
+                boarding[code] = None
+                isAhead = self.line.shapeAhead(code, self.currentIndex, direction)
+            else:
+                #Check if we can find a transfer route
+                if network:
+                    transferStation = network.routes.nextTransfer(currentStation, code)
+                else:
+                    transferStation = findTransfer(currentStation, SHAPES[code])
+                if not transferStation or not self.line.hasStation(transferStation):
+                    continue
+                boarding[code] = transferStation
+                isAhead = (self.line.indexOf(transferStation) - self.currentIndex) * direction > 0
+            (ahead if isAhead else behind).append(code)
+        for codes in (ahead, behind):
+            for passenger in currentStation.passengers.take(codes, space):
+                passenger.transferStation = boarding[passenger.shapeCode]
+                self.passengers.append(passenger)
+                space -= 1
+
+        return deliveredCount
+
+
+class Simulation:
+    #One game, owns everything that changes over time
+    def __init__(self, mapName='New York', difficulty='Easy', seed=None, width=1600, height=900, startStations=True, demand=None, routing='time'):
+        self.mapName = mapName
+        self.difficulty = difficulty
+        self.width = width
+        self.height = height
+        if seed is None: #Every game gets a seed so it can be replayed
+            seed = random.randrange(2**32)
+        self.seed = seed
+        self.random = random.Random(seed) #Own stream so parallel games don't share state
+        settings = DIFFICULTIES[difficulty]
+        self.passengerSpawnRate = settings['passengerSpawnRate']
+        self.stationSpawnRate = settings['stationSpawnRate']
+        self.stationLimit = settings['stationLimit']
+        self.spawnLimit = settings['spawnLimit']
+        self.stationCapacity = settings['stationCapacity']
+        self.spareTrains = settings['spareTrains']
+        self.spareCarriages = settings['spareCarriages']
+        self.shapes = list(settings['shapes'])
+        self.colors = list(settings['colors'])
+        self.stations = []
+        self.lines = []
+        self.grid = SpatialGrid(80) #Cells as wide as the spawn spacing
+        self.demand = demand #Spawn weighting by region and time, None for even spawns
+        self.spawns = SpawnModel(demand)
+        if routing not in ROUTINGS:
+            raise ValueError(f'Unknown routing: {routing}')
+        self.routing = routing
+        self.routes = ROUTINGS[routing](self.stations, self.lines)
+        #Network changes go out as events, indexes that can be updated in place subscribe
+        #Caches that are simply rebuilt compare topologyVersion instead
+        self.topology = TopologyEvents()
+        self.topology.subscribe(self.indexTopology)
+        self.topology.subscribe(self.routes.topologyChanged)
+        self.segment_map = {} #Segment -> lines sharing it, sorted by color
+        self.trackOffsets = {} #(segment, line) -> sideways shift of that line's track
+        self.timer = 0
+        self.motionTimer = 0 #Steps the game was not paused for, trains run on this clock
+        self.timerEvents = Scheduler() #Ramps and spawns, by timer
+        self.trainEvents = Scheduler() #Train arrivals, by motionTimer so pausing holds them back
+        self.grownQueues = set() #Stations that got passengers this step, checked for overcrowding
+        self.nextPassengerSpawn = None
+        self.passengersTrips = 0
+        self.paused = False
+        self.gameOver = False
+        self.actions = [] #(timer, kind, args) of every player action, for replays
+        self.candidates = None #(station, topologyVersion, candidates) of the last connectionCandidates call
+        self.profiler = None #FrameProfiler timing each phase of a step, see profiler.py
+        self.metrics = None #FlowMetrics sampling queues, loads and trip times, see metrics.py
+        self.kinematics = None #TrainArrays placing every train at once for drawing, see kinematics.py
+        self.sites = None #Station sites of a procedural map, taken in order as stations spawn
+        if mapName == PROCEDURAL_MAP:
+            #Own random stream, so the same seed and size always give the same map, also when loading a snapshot
+            bounds = (100, 100, width - 100, height - 200)
+            self.sites = poissonDisk(random.Random(seed), bounds, SITE_SPACING, self.stationLimit)
+            self.stationLimit = min(self.stationLimit, len(self.sites))
+        if startStations: #Snapshots bring their own stations
+            if self.sites is not None:
+                for (x, y), shape in zip(self.sites, ('circle', 'square', 'triangle')):
+                    self.addStation(Station(x, y, shape))
+            else:
+                for x, y, shape in MAPS[mapName]:
+                    self.addStation(Station(x, y, shape))
+        self.scheduleSpawns()
+
+    def step(self):
+        self.advance(self.timer + 1)
+
+    def advance(self, targetTimer, stopWhen=None):
+        #Jumps from one due event to the next until targetTimer, game over, or stopWhen() turns true
+        #Nothing happens on the steps in between, so skipping them gives the same game as stepping
+        while not self.gameOver and self.timer < targetTimer:
+            self.runStep(min(targetTimer, self.nextEventStep()))
+            if stopWhen is not None and stopWhen():
+                break
+        return self.timer
+
+    def nextEventStep(self):
+        steps = [self.timerEvents.nextStep()]
+        if not self.paused and self.trainEvents:
+            steps.append(self.timer + self.trainEvents.nextStep() - self.motionTimer)
+        return min(step for step in steps if step is not None)
+
+    def runStep(self, step):
+        if not self.paused:
+            self.motionTimer += step - self.timer
+        self.timer = step
+        if self.profiler is not None and self.profiler.stepTicks: #The window ticks once per frame instead
+            self.profiler.startTick(self.timer)
+
+        self.timerEvents.runDue(step, RAMP) #Over time increase spawn freq, even while paused
+        if self.paused: #Spawns due now are skipped, their handlers book the next ones
+            self.timerEvents.runDue(step)
+            return
+        if self.trainEvents.nextStep() == self.motionTimer:
+            self.phase('trains', self.trainEvents.runDue, self.motionTimer)
+        self.timerEvents.runDue(step)
+        if self.grownQueues:
+            self.phase('overcrowding', self.checkOvercrowding)
+        if self.metrics is not None:
+            self.phase('metrics', self.metrics.stepped, self)
+
+    def phase(self, name, fn, *args):
+        #Runs one part of a step, timed when a profiler is attached
+        if self.profiler is None:
+            return fn(*args)
+        return self.profiler.measure(name, fn, *args)
+
+    def scheduleSpawns(self):
+        #Books the next ramp and spawns after the current step
+        self.timerEvents.clear()
+        self.nextPassengerSpawn = None
+        if self.passengerSpawnRate > self.spawnLimit:
+            self.timerEvents.push((self.timer // RAMP_STEPS + 1) * RAMP_STEPS, RAMP, self.rampDifficulty)
+        self.schedulePassengerSpawn(self.timer + 1)
+        if len(self.stations) < self.stationLimit:
+            step = (self.timer // self.stationSpawnRate + 1) * self.stationSpawnRate
+            self.timerEvents.push(step, STATION_SPAWN, self.stationSpawnDue)
+
+    def rampDifficulty(self):
+        if self.passengerSpawnRate > self.spawnLimit:
+            self.passengerSpawnRate -= 1
+            self.schedulePassengerSpawn(self.timer) #Spawns fall on multiples of the rate, which just changed
+        if self.passengerSpawnRate > self.spawnLimit:
+            self.timerEvents.push(self.timer + RAMP_STEPS, RAMP, self.rampDifficulty)
+
+    def schedulePassengerSpawn(self, earliest):
+        #Next multiple of the spawn rate from earliest on, a booking it replaces is ignored when it comes up
+        step = -(-earliest // self.passengerSpawnRate) * self.passengerSpawnRate
+        if step != self.nextPassengerSpawn:
+            self.nextPassengerSpawn = step
+            self.timerEvents.push(step, PASSENGER_SPAWN, lambda: self.passengerSpawnDue(step))
+
+    def passengerSpawnDue(self, step):
+        if step != self.nextPassengerSpawn: #Rebooked by a ramp
+            return
+        if not self.paused:
+            self.phase('passengerSpawn', self.spawnPassenger)
+        self.schedulePassengerSpawn(step + 1)
+
+    def stationSpawnDue(self):
+        if not self.paused:
+            self.phase('stationSpawn', self.spawnStation)
+        if len(self.stations) < self.stationLimit:
+            self.timerEvents.push(self.timer + self.stationSpawnRate, STATION_SPAWN, self.stationSpawnDue)
+
+    def trainScheduled(self, train):
+        if self.kinematics is not None:
+            self.kinematics.update(train)
+        trip = train.trip
+        self.trainEvents.push(train.arriveStep, train.order, lambda: self.trainArrives(train, trip))
+
+    def trainArrives(self, train, trip):
+        if trip == train.trip: #Otherwise the train was given a new schedule since
+            self.passengersTrips += train.arrive()
+
+    def queueGrew(self, station):
+        self.grownQueues.add(station)
+
+    def spawnPassenger(self):
+        if not self.stations:
+            return
+        count = self.demand.passengersAt(self.timer) if self.demand else 1
+        for _ in range(count):
+            startStation, destinationCode = self.spawns.sample(self.random)
+            if destinationCode is not None:
+                startStation.passengers.append(Passenger(destinationCode, self.timer))
+                self.queueGrew(startStation)
+
+    def spawnStation(self):
+        if self.sites is not None: #Procedural sites are already spaced apart, the next one is always free
+            if len(self.stations) < self.stationLimit:
+                x, y = self.sites[len(self.stations)]
+                self.addStation(Station(x, y, self.random.choice(self.shapes)))
+            return
+        if len(self.stations) < self.stationLimit:
+            x = self.random.randint(100, self.width - 100)
+            y = self.random.randint(100, self.height - 200)
+            shape = self.random.choice(self.shapes)
+            newStation = Station(x, y, shape)
+            isOverlapping = self.grid.near(x, y, newStation.radius * 4)
+            if not isOverlapping:
+                self.addStation(newStation)
+
+    def checkOvercrowding(self):
+        #Only stations whose queue grew this step can have gone over
+        for station in self.grownQueues:
+            if len(station.passengers) > self.stationCapacity:
+                self.gameOver = True
+        self.grownQueues.clear()
+
+    @property
+    def topologyVersion(self):
+        #Goes up on every network change
+        return self.topology.version
+
+    def topologyChanged(self):
+        #Whole network replaced without events, like a snapshot load
+        self.topology.publish('reset')
+
+    def segmentAdded(self, line, s1, s2):
+        #Called by lines when they gain a station
+        self.topology.publish('segmentAdded', line, s1, s2)
+
+    def indexTopology(self, kind, *args):
+        #Spatial grid, spawn weights and shared-track offsets follow the network one change at a time
+        if kind == 'stationAdded':
+            station = args[0]
+            self.grid.add(station)
+            self.spawns.add(station)
+        elif kind == 'segmentAdded':
+            self.phase('segmentMap', self.updateSegmentMap, *args)
+
+    def updateSegmentMap(self, line, s1, s2):
+        #Gemini AI - keeps the map of all shared tracks up to date, one segment at a time
+        segment = segmentKey(s1, s2)
+        lines = self.segment_map.setdefault(segment, [])
+        if line not in lines:
+            lines.append(line)
+            lines.sort(key=lambda l: l.color)
+            #Spread the lines on this segment evenly around its centre
+            dx, dy = segment[1].x - segment[0].x, segment[1].y - segment[0].y
+            dist = (dx**2 + dy**2)**0.5
+            n = len(lines)
+            for i, sharedLine in enumerate(lines):
+                offset_distance = (i - (n - 1) / 2.0) * TRACK_SPACING
+                if dist > 0:
+                    self.trackOffsets[(segment, sharedLine)] = (offset_distance * -dy / dist, offset_distance * dx / dist)
+                else:
+                    self.trackOffsets[(segment, sharedLine)] = (0, 0)
+
+    def run(self, maxSteps):
+        #Play until game over or maxSteps, returns the final timer
+        return self.advance(maxSteps)
+
+    def addStation(self, station):
+        self.stations.append(station)
+        self.topology.publish('stationAdded', station)
+
+    def stationAt(self, x, y):
+        return self.grid.stationAt(x, y)
+
+    def connectionCandidates(self, station):
+        #Stations that clicking after station would extend a line to, and ones that would start a new line
+        #Worked out once per selection and network, not on every frame the selection is drawn
+        cached = self.candidates
+        if cached is not None and cached[0] is station and cached[1] == self.topologyVersion:
+            return cached[2]
+        extendable, newLine = [], []
+        canAddLine = len(self.lines) < len(self.colors)
+        for other in self.stations:
+            if other is not station:
+                if findExtendableLine(station, other)[0]:
+                    extendable.append(other)
+                elif canAddLine:
+                    newLine.append(other)
+        self.candidates = (station, self.topologyVersion, (extendable, newLine))
+        return extendable, newLine
+
+    def togglePause(self):
+        self.actions.append((self.timer, 'pause', ()))
+        self.paused = not self.paused
+
+    def connect(self, station1, station2, forceNewLine=False):
+        #Same rules as clicking two stations, returns False if no line could be made
+        self.actions.append((self.timer, 'connect', (self.stations.index(station1), self.stations.index(station2), forceNewLine)))
+        extendableLine, endpointStation, newStation = findExtendableLine(station1, station2)
+        if extendableLine and not forceNewLine: #Extend line
+            extendableLine.extendLine(newStation, endpointStation)
+            return True
+        if len(self.lines) < len(self.colors): #Create new line
+            new_line = Line(self.colors[len(self.lines)], self)
+            self.lines.append(new_line) #Before linking, so subscribers of its segmentAdded see it in sim.lines
+            new_line.linkStation(station1)
+            new_line.linkStation(station2)
+            return True
+        return False
+
+    def addTrain(self, line, station):
+        #Puts a spare train on line, starting at station, returns False if there is none to use
+        self.actions.append((self.timer, 'train', (self.lines.index(line), self.stations.index(station))))
+        if self.spareTrains <= 0 or station not in line.stations:
+            return False
+        line.addTrain(line.stations.index(station))
+        self.spareTrains -= 1
+        return True
+
+    def addCarriage(self, train):
+        #Hooks a spare carriage onto train, returns False if there is none to use
+        line = train.line
+        self.actions.append((self.timer, 'carriage', (self.lines.index(line), line.trains.index(train))))
+        if self.spareCarriages <= 0:
+            return False
+        train.addCarriage()
+        self.spareCarriages -= 1
+        return True
+
+    def waitingPassengers(self):
+        return sum(len(station.passengers) for station in self.stations)
@@ -0,0 +1,216 @@
+#Snapshots store the full state of a game mid-way, so it can be picked up again without replaying from step 0
+#Binary and versioned: a header, then length-prefixed arrays of numbers, strings go through one string table
+#Usage: python snapshot.py replays/<file>.json <step> <out.snap>   (fixture from a replay at a given step)
+
+import os
+import struct
+import sys
+from array import array
+from simulation import Simulation, Station, Passenger, Line, DEMANDS, demandName, shapeCode
+
+SNAPSHOT_MAGIC = b'MMSN'
+SNAPSHOT_VERSION = 4 #2: trains store their schedule instead of position and wait timer, 3: routing and demand preset, 4: spawn steps
+
+#Replay action kinds, stored as their index with up to three int arguments
+ACTION_KINDS = ['connect', 'pause', 'train', 'carriage']
+
+class SnapshotWriter:
+    def __init__(self):
+        self.chunks = []
+        self.strings = [] #Index -> string
+        self.stringCodes = {}
+
+    def code(self, string):
+        if string not in self.stringCodes:
+            self.stringCodes[string] = len(self.strings)
+            self.strings.append(string)
+        return self.stringCodes[string]
+
+    def put(self, typecode, values):
+        values = array(typecode, values)
+        if sys.byteorder != 'little':
+            values.byteswap()
+        self.chunks.append(struct.pack('<I', len(values)))
+        self.chunks.append(values.tobytes())
+
+    def getvalue(self):
+        #String table goes first so the reader can decode codes as it goes
+        table = b''.join(struct.pack('<H', len(data)) + data for data in (s.encode() for s in self.strings))
+        header = struct.pack('<4sHI', SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(self.strings))
+        return header + table + b''.join(self.chunks)
+
+class SnapshotReader:
+    def __init__(self, data):
+        magic, version, stringCount = struct.unpack_from('<4sHI', data)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError('Not a Micro Metro snapshot')
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f'Unsupported snapshot version {version}')
+        self.data = data
+        self.offset = struct.calcsize('<4sHI')
+        self.strings = []
+        for _ in range(stringCount):
+            (length,) = struct.unpack_from('<H', data, self.offset)
+            self.offset += 2
+            self.strings.append(data[self.offset:self.offset + length].decode())
+            self.offset += length
+
+    def get(self, typecode):
+        (count,) = struct.unpack_from('<I', self.data, self.offset)
+        self.offset += 4
+        values = array(typecode)
+        size = count * values.itemsize
+        values.frombytes(self.data[self.offset:self.offset + size])
+        if sys.byteorder != 'little':
+            values.byteswap()
+        self.offset += size
+        return values
+
+def putPassengers(writer, passengers, stationIndex):
+    passengers = list(passengers)
+    writer.put('H', [writer.code(p.destinationShape) for p in passengers])
+    writer.put('i', [stationIndex[p.transferStation] if p.transferStation else -1 for p in passengers])
+    writer.put('q', [-1 if p.spawnStep is None else p.spawnStep for p in passengers])
+
+def getPassengers(reader, stations):
+    shapes, transfers, spawnSteps = reader.get('H'), reader.get('i'), reader.get('q')
+    passengers = []
+    for shape, transfer, spawnStep in zip(shapes, transfers, spawnSteps):
+        passenger = Passenger(shapeCode(reader.strings[shape]), spawnStep if spawnStep >= 0 else None)
+        passenger.transferStation = stations[transfer] if transfer >= 0 else None
+        passengers.append(passenger)
+    return passengers
+
+def dumpSnapshot(sim):
+    writer = SnapshotWriter()
+    stationIndex = {station: i for i, station in enumerate(sim.stations)}
+    lineIndex = {line: i for i, line in enumerate(sim.lines)}
+
+    #Game settings first: the random stream only carries on the same way under the same routing and demand
+    writer.put('H', [writer.code(sim.mapName), writer.code(sim.difficulty), writer.code(sim.routing), writer.code(demandName(sim.demand))])
+    writer.put('q', [sim.seed, sim.width, sim.height, sim.timer, sim.motionTimer, sim.passengersTrips, sim.paused, sim.gameOver,
+                     sim.passengerSpawnRate, sim.stationSpawnRate, sim.stationLimit, sim.spawnLimit,
+                     sim.stationCapacity, sim.spareTrains, sim.spareCarriages])
+    writer.put('H', [writer.code(shape) for shape in sim.shapes])
+    writer.put('H', [writer.code(color) for color in sim.colors])
+    #Random stream, so the game carries on exactly as it would have
+    rngVersion, rngState, gauss = sim.random.getstate()
+    writer.put('q', [rngVersion, gauss is not None])
+    writer.put('I', rngState)
+    writer.put('d', [gauss or 0.0])
+
+    #Stations, with the order their lines reached them (that order decides extension priority)
+    writer.put('d', [value for station in sim.stations for value in (station.x, station.y, station.radius)])
+    writer.put('H', [writer.code(station.shape) for station in sim.stations])
+    writer.put('I', [len(station.lines) for station in sim.stations])
+    writer.put('I', [lineIndex[line] for station in sim.stations for line in station.lines])
+    for station in sim.stations:
+        putPassengers(writer, station.passengers, stationIndex)
+
+    #Lines and their trains
+    writer.put('H', [writer.code(line.color) for line in sim.lines])
+    for line in sim.lines:
+        writer.put('I', [stationIndex[station] for station in line.stations])
+        writer.put('q', [value for train in line.trains for value in
+                         (train.currentIndex, train.targetIndex, train.direction, train.departStep, train.carriages, train.capacity)])
+        writer.put('d', [value for train in line.trains for value in (train.fromX, train.fromY, train.speed)])
+        for train in line.trains:
+            putPassengers(writer, train.passengers, stationIndex)
+
+    #Actions so far, a game saved as a replay after loading still plays back from step 0
+    rows = []
+    for timer, kind, args in sim.actions:
+        args = [int(arg) for arg in args]
+        rows.extend([timer, ACTION_KINDS.index(kind), len(args)] + args + [0] * (3 - len(args)))
+    writer.put('q', rows)
+    return writer.getvalue()
+
+def restoreSnapshot(data):
+    reader = SnapshotReader(data)
+    strings = reader.strings
+    mapName, difficulty, routing, demand = (strings[code] for code in reader.get('H'))
+    (seed, width, height, timer, motionTimer, trips, paused, gameOver, passengerSpawnRate, stationSpawnRate,
+     stationLimit, spawnLimit, stationCapacity, spareTrains, spareCarriages) = reader.get('q')
+    sim = Simulation(mapName, difficulty, seed, width, height, startStations=False, demand=DEMANDS[demand], routing=routing)
+    sim.timer, sim.motionTimer, sim.passengersTrips = timer, motionTimer, trips
+    sim.paused, sim.gameOver = bool(paused), bool(gameOver)
+    sim.passengerSpawnRate, sim.stationSpawnRate = passengerSpawnRate, stationSpawnRate
+    sim.stationLimit, sim.spawnLimit, sim.stationCapacity = stationLimit, spawnLimit, stationCapacity
+    sim.spareTrains, sim.spareCarriages = spareTrains, spareCarriages
+    sim.shapes = [strings[code] for code in reader.get('H')]
+    sim.colors = [strings[code] for code in reader.get('H')]
+    rngVersion, hasGauss = reader.get('q')
+    rngState = tuple(reader.get('I'))
+    gauss = reader.get('d')[0]
+    sim.random.setstate((rngVersion, rngState, gauss if hasGauss else None))
+
+    coordinates = reader.get('d')
+    shapes = reader.get('H')
+    for i, shape in enumerate(shapes):
+        station = Station(coordinates[3*i], coordinates[3*i + 1], strings[shape])
+        station.radius = coordinates[3*i + 2]
+        sim.addStation(station)
+    lineCounts, lineIndices = reader.get('I'), reader.get('I')
+    for station in sim.stations:
+        for passenger in getPassengers(reader, sim.stations):
+            station.passengers.append(passenger)
+
+    for code in reader.get('H'):
+        sim.lines.append(Line(strings[code], sim))
+    for line in sim.lines:
+        for i, station in enumerate(sim.stations[s] for s in reader.get('I')):
+            line.stations.append(station)
+            line.indexStop(station, i)
+            if i > 0:
+                sim.segmentAdded(line, line.stations[i-1], station)
+        ints, floats = reader.get('q'), reader.get('d')
+        for t in range(len(floats) // 3):
+            currentIndex, targetIndex, direction, departStep, carriages, capacity = ints[6*t:6*t + 6]
+            fromX, fromY, speed = floats[3*t:3*t + 3]
+            train = line.addTrain(currentIndex)
+            train.direction, train.targetIndex, train.speed = direction, targetIndex, speed
+            train.carriages, train.capacity = carriages, capacity
+            train.depart(fromX, fromY, departStep) #Replaces the schedule addTrain gave it
+            train.passengers = getPassengers(reader, sim.stations)
+
+    #Station line lists go in last, in their saved order
+    position = 0
+    for station, count in zip(sim.stations, lineCounts):
+        station.lines = [sim.lines[i] for i in lineIndices[position:position + count]]
+        position += count
+
+    rows = reader.get('q')
+    for r in range(0, len(rows), 6):
+        timer, kind, argCount = rows[r:r + 3]
+        args = tuple(rows[r + 3:r + 3 + argCount])
+        if ACTION_KINDS[kind] == 'connect':
+            args = args[:2] + (bool(args[2]),)
+        sim.actions.append((timer, ACTION_KINDS[kind], args))
+    sim.topologyChanged() #Station line lists were replaced above
+    sim.scheduleSpawns()
+    return sim
+
+def saveSnapshot(sim, path):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(dumpSnapshot(sim))
+
+def loadSnapshot(path):
+    with open(path, 'rb') as f:
+        return restoreSnapshot(f.read())
+
+def main():
+    #Turns a replay into a snapshot fixture at the given step
+    from replay import loadReplay, playReplay
+    if len(sys.argv) != 4:
+        print('Usage: python snapshot.py replays/<file>.json <step> <out.snap>')
+        sys.exit(2)
+    sim = playReplay(loadReplay(sys.argv[1]), int(sys.argv[2]))
+    saveSnapshot(sim, sys.argv[3])
+    print(f'{sys.argv[3]}: step {sim.timer}, {len(sim.stations)} stations, {len(sim.lines)} lines, '
+          f'{sim.passengersTrips} trips, {os.path.getsize(sys.argv[3])} bytes')
+
+if __name__ == '__main__':
+    main()
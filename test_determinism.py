@@ -0,0 +1,90 @@
+#Games must come out the same however they are run: stepping or jumping between events,
+#carried on from a snapshot, or played back from a replay
+#Usage: python -m pytest test_determinism.py
+
+import pytest
+from montecarlo import decisionTarget
+from planner import POLICIES
+from replay import saveReplay, loadReplay, playReplay
+from simulation import Simulation, DEMANDS, PROCEDURAL_MAP
+from snapshot import dumpSnapshot, restoreSnapshot
+
+GAMES = [('New York', 'Hard', 2, 'greedy'), ('Tokyo', 'Medium', 0, 'tree'), ('Hong Kong', 'Easy', 1, 'scripted'),
+         (PROCEDURAL_MAP, 'Stress', 3, 'greedy')]
+MAX_STEPS = 36000 #10 minutes of game time
+
+def outcome(sim):
+    return sim.timer, sim.passengersTrips, sim.gameOver, [len(station.passengers) for station in sim.stations]
+
+def advancedGame(mapName, difficulty, seed, policyName, maxSteps=MAX_STEPS, trainArrays=False, demand='uniform'):
+    #Like montecarlo.py: jump to the next event or timed decision
+    sim = Simulation(mapName, difficulty, seed, demand=DEMANDS[demand])
+    if trainArrays:
+        from kinematics import TrainArrays
+        TrainArrays(sim)
+    policy = POLICIES[policyName]()
+    policy.act(sim)
+    while not sim.gameOver and sim.timer < maxSteps:
+        sim.advance(decisionTarget(policy, sim, maxSteps), lambda: policy.needsAction(sim))
+        if policy.needsAction(sim):
+            policy.act(sim)
+    return sim
+
+def steppedGame(mapName, difficulty, seed, policyName, maxSteps=MAX_STEPS):
+    #Like the window: one step at a time
+    sim = Simulation(mapName, difficulty, seed)
+    policy = POLICIES[policyName]()
+    policy.act(sim)
+    while not sim.gameOver and sim.timer < maxSteps:
+        sim.step()
+        if policy.needsAction(sim):
+            policy.act(sim)
+    return sim
+
+@pytest.mark.parametrize('mapName, difficulty, seed, policyName', GAMES)
+def test_advance_matches_step(mapName, difficulty, seed, policyName):
+    assert outcome(advancedGame(mapName, difficulty, seed, policyName)) == outcome(steppedGame(mapName, difficulty, seed, policyName))
+
+@pytest.mark.parametrize('mapName, difficulty, seed, policyName', GAMES)
+def test_snapshot_carries_on(mapName, difficulty, seed, policyName):
+    sim = advancedGame(mapName, difficulty, seed, policyName, maxSteps=4000)
+    loaded = restoreSnapshot(dumpSnapshot(sim))
+    assert outcome(loaded) == outcome(sim)
+    sim.advance(12000)
+    loaded.advance(12000)
+    assert outcome(loaded) == outcome(sim)
+
+def test_train_arrays_match():
+    pytest.importorskip('numpy')
+    sim = advancedGame('New York', 'Hard', 2, 'greedy', trainArrays=True)
+    assert outcome(sim) == outcome(advancedGame('New York', 'Hard', 2, 'greedy'))
+    for train in (train for line in sim.lines for train in line.trains):
+        assert sim.kinematics.positionAt(train, sim.motionTimer + 0.5) == pytest.approx(train.positionAt(sim.motionTimer + 0.5))
+
+@pytest.mark.parametrize('mapName, difficulty, seed, policyName', GAMES)
+def test_replay_plays_back(mapName, difficulty, seed, policyName, tmp_path):
+    sim = advancedGame(mapName, difficulty, seed, policyName)
+    path = tmp_path / 'game.json'
+    saveReplay(sim, str(path))
+    assert outcome(playReplay(loadReplay(str(path)))) == outcome(sim)
+
+@pytest.mark.parametrize('routing', ['hops', 'time'])
+@pytest.mark.parametrize('demand', list(DEMANDS))
+def test_snapshot_keeps_settings(demand, routing):
+    sim = Simulation('New York', 'Medium', 4, demand=DEMANDS[demand], routing=routing)
+    sim.advance(2000)
+    loaded = restoreSnapshot(dumpSnapshot(sim))
+    assert (loaded.routing, loaded.demand) == (routing, DEMANDS[demand])
+
+def test_snapshot_keeps_spawn_steps():
+    sim = advancedGame('Tokyo', 'Medium', 0, 'greedy', maxSteps=4000)
+    spawnSteps = lambda sim: [[p.spawnStep for p in holder.passengers]
+                              for holder in sim.stations + [train for line in sim.lines for train in line.trains]]
+    assert spawnSteps(restoreSnapshot(dumpSnapshot(sim))) == spawnSteps(sim)
+
+@pytest.mark.parametrize('demand', list(DEMANDS))
+def test_replay_keeps_demand(demand, tmp_path):
+    sim = advancedGame('New York', 'Medium', 4, 'greedy', demand=demand)
+    path = tmp_path / 'game.json'
+    saveReplay(sim, str(path))
+    assert outcome(playReplay(loadReplay(str(path)))) == outcome(sim)